@@ -0,0 +1,157 @@
+import asyncio
+import concurrent.futures
+import threading
+from concurrent.futures import Executor
+from typing import Optional, Union, AsyncIterable, Iterable
+from coding.coding_params import CodingParams
+from coding.stats import CodingStats
+from coding.stream import encode_stream, decode_stream
+from utils.iter_utils import iter_str_chunks, QueueReader, QueueWriter
+
+# Same archives as main.zip/unzip, for asyncio services. The coder runs in an executor thread and talks to
+# the event loop through two bounded asyncio queues: a slow client stalls the coder (out queue is full),
+# a slow coder stalls reading from the source (in queue is full). So a stream holds at most
+# 2 * ASYNC_QUEUE_SIZE chunks besides the model itself, however long it is.
+# Streams wait for a free executor thread, so the executor size bounds how many are coded at once.
+# Coder threads share the GIL with the loop: the more of them, the longer the loop waits for its turn,
+# hence a small default executor instead of asyncio's
+
+ASYNC_CHUNK_SIZE = 64 * 1024
+ASYNC_QUEUE_SIZE = 4
+ASYNC_CODERS = 4
+ABORT_POLL_S = 0.5
+
+_default_executor: Optional[Executor] = None
+
+Source = Union[asyncio.StreamReader, AsyncIterable[bytes]]
+
+
+# length is needed up front, it goes into the header before the first coded bit.
+# Decapitalization, the word dictionary and the semi-static model need extra passes over the text,
+# so a stream can't have them
+async def compress(source: Source, writer: asyncio.StreamWriter, length,
+                   coding_params: CodingParams = CodingParams(), executor: Optional[Executor] = None,
+                   stats: Optional[CodingStats] = None):
+    if coding_params.decapitalize or coding_params.word_dictionary or coding_params.semi_static:
+        raise Exception('Decapitalization, word dictionary and semi-static model need several passes over the text, '
+                        'can\'t stream them')
+
+    def code(bridge: _LoopBridge):
+        text = (c for chunk in iter(bridge.get, None) for c in chunk.decode('iso-8859-1'))
+        passes = 0
+
+        def iter_source():
+            nonlocal passes
+            passes += 1
+            if passes > 1:
+                raise Exception('Stream can be read only once')
+            return _exactly(text, length)
+
+        encode_stream(iter_source, length, QueueWriter(bridge.put), coding_params, stats)
+
+    await _run(source, writer, code, executor)
+
+
+async def decompress(source: Source, writer: asyncio.StreamWriter, executor: Optional[Executor] = None,
+                     stats: Optional[CodingStats] = None):
+    def code(bridge: _LoopBridge):
+        for chunk in iter_str_chunks(decode_stream(QueueReader(bridge.get), stats), ASYNC_CHUNK_SIZE):
+            bridge.put(chunk.encode('iso-8859-1'))
+
+    await _run(source, writer, code, executor)
+
+
+# blocking get/put on the loop's queues for the executor thread; abort() unblocks it when the loop side fails
+class _LoopBridge:
+    def __init__(self, loop, in_q: asyncio.Queue, out_q: asyncio.Queue):
+        self.loop = loop
+        self.in_q = in_q
+        self.out_q = out_q
+        self.aborted = threading.Event()
+
+    def get(self) -> Optional[bytes]:
+        return self._wait(self.in_q.get())
+
+    def put(self, b: Optional[bytes]):
+        self._wait(self.out_q.put(b))
+
+    def abort(self):
+        self.aborted.set()
+
+    def _wait(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        while True:
+            try:
+                return future.result(timeout=ABORT_POLL_S)
+            except concurrent.futures.TimeoutError:
+                if self.aborted.is_set():
+                    future.cancel()
+                    raise Exception('Stream aborted')
+
+
+def _get_default_executor():
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = concurrent.futures.ThreadPoolExecutor(ASYNC_CODERS, thread_name_prefix='ppm-coder')
+    return _default_executor
+
+
+async def _run(source: Source, writer, code, executor):
+    loop = asyncio.get_running_loop()
+    executor = executor or _get_default_executor()
+    bridge = _LoopBridge(loop, asyncio.Queue(ASYNC_QUEUE_SIZE), asyncio.Queue(ASYNC_QUEUE_SIZE))
+
+    def code_then_end():
+        code(bridge)
+        bridge.put(None)
+
+    tasks = [
+        asyncio.ensure_future(loop.run_in_executor(executor, code_then_end)),
+        asyncio.create_task(_feed(source, bridge.in_q)),
+        asyncio.create_task(_drain(bridge.out_q, writer)),
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        failed = [task for task in tasks if task in done and task.exception() is not None]
+        if failed:
+            raise failed[0].exception()
+        await asyncio.gather(*tasks)
+    finally:
+        bridge.abort()
+        for task in tasks[1:]:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _feed(source: Source, in_q: asyncio.Queue):
+    if isinstance(source, asyncio.StreamReader):
+        while True:
+            chunk = await source.read(ASYNC_CHUNK_SIZE)
+            if not chunk:
+                break
+            await in_q.put(chunk)
+    else:
+        async for chunk in source:
+            if chunk:
+                await in_q.put(bytes(chunk))
+    await in_q.put(None)
+
+
+async def _drain(out_q: asyncio.Queue, writer):
+    while True:
+        chunk = await out_q.get()
+        if chunk is None:
+            return
+        writer.write(chunk)
+        await writer.drain()
+
+
+def _exactly(iter_char: Iterable[str], length) -> Iterable[str]:
+    count = 0
+    for c in iter_char:
+        count += 1
+        if count > length:
+            raise Exception(f'Stream is longer than {length} chars')
+        yield c
+    if count != length:
+        raise Exception(f'Stream has {count} chars instead of {length}')
@@ -1,5 +1,6 @@
 import os
 import gc
+import filecmp
 import time
 import threading
 from dataclasses import dataclass
@@ -57,12 +58,8 @@ def get_archiver_stats(zip_func, unzip_func, path_to_txt: str, coding_params: Co
     gc.collect()
     max_mem_mb = -1
 
-    with open(path_to_txt, newline='', encoding='iso-8859-1') as f_orig, \
-            open(f'{path_to_txt}.unzipped', newline='', encoding='iso-8859-1') as f_new:
-        orig_text = f_orig.read()
-        new_text = f_new.read()
-        if orig_text != new_text:
-            raise Exception()
+    if not filecmp.cmp(path_to_txt, f'{path_to_txt}.unzipped', shallow=False):  # chunked, not the whole files
+        raise Exception()
 
     original_size = os.path.getsize(path_to_txt)
     archive_size = os.path.getsize(f'{path_to_txt}.myzip')
@@ -1,34 +1,176 @@
-from typing import Iterable
-from coding.context_tree import LeftContextTree
+from typing import Iterable, Optional, List
+from coding.context_tree import LeftContextTree, InstrumentedLeftContextTree, EstimatingLeftContextTree
+from coding.hashed_context import HashedContextTable, InstrumentedHashedContextTable
 from coding.bit_number_range import BitNumberRange, DecoderWithRange
+from coding.match_model import MatchModel
+from coding.unbounded_context import UnboundedContextModel
+from coding.line_model import LineFieldModel
+from coding.mixing import MixingModel
+from coding.stats import CodingStats, step_bits
 import itertools
 
 
+# LeftContextTree, or HashedContextTable with hash_bits; instrumented for stats, and for estimation if it matters
+def make_tree(coding_params, stats: Optional[CodingStats] = None, estimating=False):
+    if coding_params.hash_bits > 0:
+        return HashedContextTable(coding_params) if stats is None \
+            else InstrumentedHashedContextTable(coding_params, stats)
+    if estimating:
+        return EstimatingLeftContextTree(coding_params, stats)
+    return LeftContextTree(coding_params) if stats is None else InstrumentedLeftContextTree(coding_params, stats)
+
+
+# The tree alone or wrapped into one of MatchModel/UnboundedContextModel/LineFieldModel/MixingModel,
+# all have the same encode/decode
+def make_model(left_ctx_tree, coding_params):
+    if (coding_params.match_length > 0) + coding_params.unbounded_order + coding_params.line_contexts + \
+            coding_params.mixing > 1:
+        raise Exception('Only one of match model, unbounded contexts, line contexts and mixing can be used at a time')
+    if coding_params.mixing:
+        return MixingModel(left_ctx_tree, coding_params)
+    if coding_params.unbounded_order:
+        return UnboundedContextModel(left_ctx_tree, coding_params.context_length)
+    if coding_params.match_length > 0:
+        return MatchModel(left_ctx_tree, coding_params.match_length)
+    if coding_params.line_contexts:
+        return LineFieldModel(left_ctx_tree)
+    return left_ctx_tree
+
+
 class StatisticEncoder:
-    def __init__(self, iter_chars, coding_params):
+    def __init__(self, iter_chars, coding_params, stats: Optional[CodingStats] = None):
         self.iter_chars = iter_chars
+        self.coding_params = coding_params
+        self.stats = stats
 
-        self.left_ctx_tree = LeftContextTree(coding_params)
+        self.left_ctx_tree = make_tree(coding_params, stats)
+        self.model = make_model(self.left_ctx_tree, coding_params)
         self.encoding_range = BitNumberRange()
 
     def encode(self) -> Iterable[int]:
-        for char in self.iter_chars:
-            for distribution, char_idx in self.left_ctx_tree.encode(char):
-                yield from self.encoding_range.project_probability_pop_prefix(distribution, char_idx)
-        yield from self.encoding_range.get_nonzero_prefix_from_range()
+        if self.stats is not None:
+            self.stats.start()
+        yield from self.encode_segment(self.iter_chars)
+        if self.stats is not None:
+            self.stats.finish(self.left_ctx_tree)
+
+    # Codes chars and ends the bits there, so that they can be decoded without whatever follows them.
+    # The model goes on from where the previous segment left it (see coding/segments.py)
+    def encode_segment(self, chars) -> Iterable[int]:
+        if self.stats is not None:
+            yield from self._encode_segment_with_stats(chars)
+        else:
+            for char in chars:
+                for distribution, char_idx in self.model.encode(char):
+                    yield from self.encoding_range.project_probability_pop_prefix(distribution, char_idx)
+        yield from self.sync_flush()
+
+    # Ends the current range: with the bits so far (padded to a byte with zeros) the decoder gets every char
+    # coded so far, no lookahead into what comes next. Only the range restarts, the model is kept
+    def sync_flush(self) -> List[int]:
+        bits = self.encoding_range.get_nonzero_prefix_from_range()
+        if self.stats is not None:
+            self.stats.output_bits += len(bits)
+        self.encoding_range = BitNumberRange()
+        return bits
+
+    def _encode_segment_with_stats(self, chars) -> Iterable[int]:
+        stats = self.stats
+        steps = []
+        for char in chars:
+            for distribution, char_idx in self.model.encode(char):
+                steps.append(step_bits(distribution, char_idx))
+                bits = self.encoding_range.project_probability_pop_prefix(distribution, char_idx)
+                stats.output_bits += len(bits)
+                yield from bits
+            stats.record_symbol(self.model.coded_order, self.model.coded_deterministic,
+                                steps, self.left_ctx_tree.mask_seen, self.model.coded_match,
+                                self.coding_params.mixing)
+            steps.clear()
+
+
+# Same model walk as StatisticEncoder, but instead of projecting distributions onto BitNumberRange
+# it only sums -log2(p) of what would be coded (into stats), no bits come out
+class StatisticEstimator:
+    FLUSH_BITS = 2  # what the range coder adds at the end, roughly
+
+    def __init__(self, iter_chars, coding_params, stats: CodingStats):
+        self.iter_chars = iter_chars
+        self.coding_params = coding_params
+        self.stats = stats
+
+        self.left_ctx_tree = make_tree(coding_params, stats, estimating=True)
+        self.model = make_model(self.left_ctx_tree, coding_params)
+
+    # estimated coded bits
+    def estimate(self) -> float:
+        self.stats.start()
+        bits = self.estimate_segment(self.iter_chars)
+        self.stats.finish(self.left_ctx_tree)
+        return bits
+
+    # estimated bits of encode_segment(chars)
+    def estimate_segment(self, chars) -> float:
+        stats = self.stats
+        model_bits = stats.model_bits()
+        for char in chars:
+            steps = [step_bits(distribution, char_idx) for distribution, char_idx in self.model.encode(char)]
+            stats.record_symbol(self.model.coded_order, self.model.coded_deterministic,
+                                steps, self.left_ctx_tree.mask_seen, self.model.coded_match,
+                                self.coding_params.mixing)
+        return stats.model_bits() - model_bits + StatisticEstimator.FLUSH_BITS
 
 
 class StatisticDecoder:
-    def __init__(self, iter_bits, length, coding_params):
+    def __init__(self, iter_bits, length, coding_params, stats: Optional[CodingStats] = None):
         self.iter_bits = iter_bits
         self.length = length
+        self.coding_params = coding_params
+        self.stats = stats
+
+        self.left_ctx_tree = make_tree(coding_params, stats)
+        self.model = make_model(self.left_ctx_tree, coding_params)
+        self.decoding_range: Optional[DecoderWithRange] = None  # one per segment
 
-        self.left_ctx_tree = LeftContextTree(coding_params)
-        self.decoding_range = DecoderWithRange(self.iter_bits)
+        # steps of the current char, for stats
+        self.steps = []
+        # one generator for all segments, so that the model is never restarted
+        self.model_chars = self.model.decode(
+            self._get_next_char if stats is None else self._get_next_char_with_stats)
 
     def decode(self) -> Iterable[str]:
-        yield from itertools.islice(
-            self.left_ctx_tree.decode(
-                lambda fenwick_distribution: self.decoding_range.get_next_char_idx(fenwick_distribution)),
-            self.length
-        )
+        if self.stats is not None:
+            self.stats.start()
+        yield from self.decode_segment(self.iter_bits, self.length)
+        if self.stats is not None:
+            self.stats.finish(self.left_ctx_tree)
+
+    # the model goes through chars like the encoder's did when it coded them (see SegmentKind.STORED_LEARNED),
+    # nothing is decoded. Between segments the decoding generator is between two chars, so this is in step with it
+    def learn_segment(self, chars):
+        for char in chars:
+            for _ in self.model.encode(char):
+                pass
+
+    # length chars of one encode_segment
+    def decode_segment(self, iter_bits, length) -> Iterable[str]:
+        self.decoding_range = DecoderWithRange(iter_bits)
+        if self.stats is None:
+            yield from itertools.islice(self.model_chars, length)
+            return
+
+        stats = self.stats
+        for char in itertools.islice(self.model_chars, length):
+            stats.record_symbol(self.model.coded_order, self.model.coded_deterministic,
+                                self.steps, self.left_ctx_tree.mask_seen, self.model.coded_match,
+                                self.coding_params.mixing)
+            self.steps.clear()
+            yield char
+
+    def _get_next_char(self, fenwick_distribution):
+        return self.decoding_range.get_next_char_idx(fenwick_distribution)
+
+    def _get_next_char_with_stats(self, fenwick_distribution):
+        char_idx = self.decoding_range.get_next_char_idx(fenwick_distribution)
+        self.steps.append(step_bits(fenwick_distribution, char_idx))
+        return char_idx
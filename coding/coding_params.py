@@ -7,6 +7,7 @@ class UpCharCodingAlrorithm(Enum):
     B_OTHER_CHAR_COUNT = 2
     C_PLUS_ONE_ON_NEW_CHAR = 3
     D_PLUS_HALF_ON_NEW_CHAR = 4
+    E_SEE = 5  # see coding/see.py
 
     @staticmethod
     def from_letter(c):
@@ -20,3 +21,13 @@ class CodingParams:
     exclude_on_update: bool = False
     up_char_coding: UpCharCodingAlrorithm = UpCharCodingAlrorithm.A_ALWAYS_ONE
     decapitalize: bool = False
+    inherit_counts: bool = False  # PPMII-style initial counts in new contexts
+    match_length: int = 0  # MatchModel min match length, 0 for no match model
+    word_dictionary: bool = False  # frequent words -> one-char codes before modelling, see coding/word_dictionary.py
+    unbounded_order: bool = False  # PPM*-style deterministic contexts longer than context_length
+    stored_segments: bool = False  # incompressible segments are written as is, see coding/segments.py
+    semi_static: bool = False  # frozen model from a first pass, segments decode on their own, see coding/semi_static.py
+    line_contexts: bool = False  # the char above in the same field of the previous line, see coding/line_model.py
+    hash_bits: int = 0  # >0: hashed tables of 2 ** hash_bits contexts per order, see coding/hashed_context.py
+    mixing: bool = False  # PPM mixed with order-1/order-2 bit models, char by bits, see coding/mixing.py
+    segmented: bool = False  # cut into segments even without the two above, deadline mode needs them (coding/deadline.py)
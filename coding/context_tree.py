@@ -4,7 +4,8 @@ from typing import Dict, Optional, Iterable, Tuple, Callable
 from fenwick import FenwickTree
 
 from coding.coding_params import UpCharCodingAlrorithm
-from utils.fenwick_utils import ExtendableFenwickTree
+from coding.see import SeeModel
+from utils.fenwick_utils import ExtendableFenwickTree, MaskedFrequencies
 
 
 def fmt_dist(distribution, point, ctx: 'LeftContext'):
@@ -31,18 +32,29 @@ class LeftContextTree:
             self.pseudo_root.distribution.add(c, 1)
 
         self.left_ctx = ''
+        # both can be lowered between segments by deadline mode (see coding/deadline.py):
+        # contexts longer than order are neither used nor updated then
+        self.order = coding_params.context_length
+        self.mask_seen = coding_params.mask_seen
+        self.frozen = False  # semi-static mode: loaded from a model, never updated (see coding/semi_static.py)
+
+        self.see = SeeModel() if coding_params.up_char_coding == UpCharCodingAlrorithm.E_SEE else None
 
         # self.current = self.root
 
-    def encode(self, c) -> Iterable[Tuple[FenwickTree, int]]:
+    # excluded: a char known not to be c (a PredictedCharModel miss), it gets no probability anywhere
+    def encode(self, c, excluded: Optional[str] = None) -> Iterable[Tuple[FenwickTree, int]]:
         # print(f'ENCODING {c} IN \'{self.left_ctx}\'')
-        char_ctx = self._go_down(self.left_ctx)
+        left_ctx = self._order_ctx()
+        char_ctx = self._go_down(left_ctx)
         longest_ctx = char_ctx
 
-        if not self.coding_params.mask_seen:
+        if not self.mask_seen and excluded is None:
             encode_ctx = char_ctx
             while True:
                 char_idx = encode_ctx.chars_to_indices.get(c)
+                if self.see is not None and encode_ctx is not self.pseudo_root:
+                    self.see.update(self._set_see_escape_freq(encode_ctx.distribution, encode_ctx), char_idx is None)
                 if char_idx is not None:
                     # print(f'''Encoding \'{c}\' in {("'" + encode_ctx.s + "'"):8} as {char_idx:2} in {fmt_dist(encode_ctx.distribution, char_idx, encode_ctx)}: {encode_ctx.distribution.__repr__()}''')
                     yield encode_ctx.distribution, char_idx
@@ -52,60 +64,115 @@ class LeftContextTree:
                 encode_ctx = encode_ctx.parent
         else:
             encode_ctx = char_ctx
-            seen_chars = set()
+            seen_chars = {excluded} if excluded is not None else set()
             while True:
-                masked_distribution, _, char_masked_idx = encode_ctx.distribution.without_chars(
-                    seen_chars, encode_ctx.chars_to_indices, find_char_idx=c)
+                masked_distribution, char_masked_idx = self._masked_distribution(encode_ctx, seen_chars, c)
+                if self.see is not None and encode_ctx is not self.pseudo_root:
+                    self.see.update(self._set_see_escape_freq(masked_distribution, encode_ctx), char_masked_idx is None)
                 if char_masked_idx is not None:
                     # print(f'''Encoding \'{c}\' in {("'" + encode_ctx.s + "'"):8} as {char_masked_idx:2} in {fmt_dist(masked_distribution, char_masked_idx, encode_ctx)}: {masked_distribution.__repr__()}''')
                     yield masked_distribution, char_masked_idx
                     break
                 # print(f'''Encoding \'↑\' in {("'" + encode_ctx.s + "'"):8} as {0:2} in {fmt_dist(masked_distribution, 0, encode_ctx)}: {masked_distribution.__repr__()}''')
                 yield masked_distribution, 0  # i give up using LeftCtx.UP, lets just write zero here
-                seen_chars |= encode_ctx.chars_to_indices.keys()
-                seen_chars.remove(LeftContext.UP)
+                if self.mask_seen:
+                    seen_chars |= encode_ctx.chars_to_indices.keys()
+                    seen_chars.remove(LeftContext.UP)
                 encode_ctx = encode_ctx.parent
 
-        self._update_tree(self.left_ctx, c, encode_ctx, longest_ctx)
+        self._update_tree(left_ctx, c, encode_ctx, longest_ctx)
         self.left_ctx = self.left_ctx[-self.coding_params.context_length + 1:] + c
         # print(f'ENCODED, CTX IS {self.left_ctx}')
 
     def decode(self, get_next_char: Callable[[FenwickTree], int]) -> Iterable[str]:
-        decoded = []
         while True:
-            char_ctx = self._go_down(self.left_ctx)
-            longest_ctx = char_ctx
+            yield self.decode_next(get_next_char)
 
-            if not self.coding_params.mask_seen:
-                encode_ctx = char_ctx
-                while True:
-                    char_idx = get_next_char(encode_ctx.distribution)
-                    char = encode_ctx.indices_to_chars[char_idx]
-                    if char == LeftContext.UP:
-                        encode_ctx = encode_ctx.parent
-                    else:
-                        decoded.append(char)
-                        yield char
-                        break
-            else:
-                encode_ctx = char_ctx
-                seen_chars = set()
-                while True:
-                    masked_distribution, masked_indices_to_ctx_indices, _ = encode_ctx.distribution.without_chars(
-                        seen_chars, encode_ctx.chars_to_indices)
-                    char_masked_idx = get_next_char(masked_distribution)
-                    char = encode_ctx.indices_to_chars[masked_indices_to_ctx_indices[char_masked_idx]]
-                    if char == LeftContext.UP:
+    def decode_next(self, get_next_char: Callable[[FenwickTree], int], excluded: Optional[str] = None) -> str:
+        left_ctx = self._order_ctx()
+        char_ctx = self._go_down(left_ctx)
+        longest_ctx = char_ctx
+
+        if not self.mask_seen and excluded is None:
+            encode_ctx = char_ctx
+            while True:
+                see_key = self._set_see_escape_freq(encode_ctx.distribution, encode_ctx) \
+                    if self.see is not None and encode_ctx is not self.pseudo_root else None
+                char_idx = get_next_char(encode_ctx.distribution)
+                char = encode_ctx.indices_to_chars[char_idx]
+                if self.see is not None:
+                    self.see.update(see_key, char == LeftContext.UP)
+                if char == LeftContext.UP:
+                    encode_ctx = encode_ctx.parent
+                else:
+                    break
+        else:
+            encode_ctx = char_ctx
+            seen_chars = {excluded} if excluded is not None else set()
+            while True:
+                masked_distribution, masked_indices_to_ctx_indices, _ = encode_ctx.distribution.without_chars(
+                    seen_chars, encode_ctx.chars_to_indices)
+                see_key = self._set_see_escape_freq(masked_distribution, encode_ctx) \
+                    if self.see is not None and encode_ctx is not self.pseudo_root else None
+                char_masked_idx = get_next_char(masked_distribution)
+                char = encode_ctx.indices_to_chars[masked_indices_to_ctx_indices[char_masked_idx]]
+                if self.see is not None:
+                    self.see.update(see_key, char == LeftContext.UP)
+                if char == LeftContext.UP:
+                    if self.mask_seen:
                         seen_chars |= encode_ctx.chars_to_indices.keys()
                         seen_chars.remove(LeftContext.UP)
-                        encode_ctx = encode_ctx.parent
-                    else:
-                        decoded.append(char)
-                        yield char
-                        break
+                    encode_ctx = encode_ctx.parent
+                else:
+                    break
 
-            self._update_tree(self.left_ctx, char, encode_ctx, longest_ctx)
-            self.left_ctx = self.left_ctx[-self.coding_params.context_length + 1:] + char
+        self._update_tree(left_ctx, char, encode_ctx, longest_ctx)
+        self.left_ctx = self.left_ctx[-self.coding_params.context_length + 1:] + char
+        return char
+
+    # encode_ctx's distribution without seen_chars, and c's index in it (None if c isn't there); escape is at 0
+    def _masked_distribution(self, encode_ctx, seen_chars, c):
+        masked_distribution, _, char_masked_idx = encode_ctx.distribution.without_chars(
+            seen_chars, encode_ctx.chars_to_indices, find_char_idx=c)
+        return masked_distribution, char_masked_idx
+
+    def set_order(self, order, mask_seen):
+        self.order = min(order, self.coding_params.context_length)
+        self.mask_seen = mask_seen
+
+    def _order_ctx(self):
+        if self.order >= self.coding_params.context_length:
+            return self.left_ctx
+        return self.left_ctx[max(len(self.left_ctx) - self.order, 0):]
+
+    # c was coded by someone else (see LineFieldModel): only moves the context, the tree doesn't learn c
+    def skip(self, c):
+        self.left_ctx = self.left_ctx[-self.coding_params.context_length + 1:] + c
+
+    # how sure the longest context is of c: 0 if it hasn't seen c, then share of c in it below 1/2, 7/8, above.
+    # For PredictedCharModel's flags, so not more levels than its CONFIDENCE_LEVELS
+    def confidence(self, c) -> int:
+        ctx = self._go_down(self._order_ctx())
+        char_idx = ctx.chars_to_indices.get(c) if ctx is not self.pseudo_root else None
+        if char_idx is None:
+            return 0
+        return confidence_level(ctx.distribution[char_idx], ctx.distribution.prefix_sum(len(ctx.distribution)))
+
+    # c was coded by someone else (see PredictedCharModel hits), the tree learns it as if it had coded it itself,
+    # but like with exclude_on_update whatever the params say: only down to the longest context that had seen c,
+    # usually the longest one. A hit doesn't look at shorter contexts, and updating all of them every char
+    # would cost like coding it
+    def update(self, c):
+        left_ctx = self._order_ctx()
+        longest_ctx = self._go_down(left_ctx)
+        encoding_ctx = longest_ctx
+        while encoding_ctx is not self.pseudo_root and not encoding_ctx.contains(c):
+            encoding_ctx = encoding_ctx.parent
+        self._update_tree(left_ctx, c, encoding_ctx, longest_ctx, exclusive=True)
+        self.skip(c)
+
+    def _set_see_escape_freq(self, distribution, ctx):
+        return self.see.set_escape_freq(distribution, len(ctx.s), ctx.get_char_count(), self.left_ctx)
 
     def _go_down(self, left_ctx):
         if self.root is None:
@@ -133,10 +200,14 @@ class LeftContextTree:
                 current = child
         return current
 
-    def _update_tree(self, left_ctx, c, encoding_ctx, longest_ctx):
+    def _update_tree(self, left_ctx, c, encoding_ctx, longest_ctx, exclusive=False):
+        if self.frozen:
+            return
         current = self._extend_down(left_ctx)
+        if self.coding_params.inherit_counts and current is not longest_ctx and longest_ctx is not self.pseudo_root:
+            current = self._add_inherited(current, c, encoding_ctx, longest_ctx)
 
-        if not self.coding_params.exclude_on_update:
+        if not (exclusive or self.coding_params.exclude_on_update):
             while True:
                 current.add(c, self.coding_params.up_char_coding)
                 current = current.parent
@@ -158,9 +229,30 @@ class LeftContextTree:
                     current.add(c, self.coding_params.up_char_coding)
                     current = current.parent
 
+    # Contexts below longest_ctx were just created by _extend_down. Instead of starting c from scratch there,
+    # they get c with a count that keeps roughly the probability it had in the context it was coded in (PPMII)
+    def _add_inherited(self, new_ctx, c, encoding_ctx, longest_ctx):
+        inherited_count = 1
+        if encoding_ctx is not self.pseudo_root:
+            found_freq = encoding_ctx.distribution[encoding_ctx.chars_to_indices[c]] \
+                if c in encoding_ctx.chars_to_indices else 0
+            found_total = encoding_ctx.distribution.prefix_sum(len(encoding_ctx.distribution))
+            inherited_count = LeftContext.inherited_count(found_freq, found_total)
+
+        current = new_ctx
+        while current is not longest_ctx:
+            current.add_inherited(c, self.coding_params.up_char_coding, inherited_count)
+            current = current.parent
+        return current
+
+
+def confidence_level(freq, total) -> int:
+    return 1 if 2 * freq < total else 2 if 8 * freq < 7 * total else 3
+
 
 class LeftContext:
     UP = '↑'
+    MAX_INHERITED_COUNT = 16
 
     def __init__(self, parent: Optional['LeftContext'], s):
         self.s = s
@@ -195,6 +287,8 @@ class LeftContext:
             elif up_char_coding == UpCharCodingAlrorithm.D_PLUS_HALF_ON_NEW_CHAR:
                 self.distribution.append(1)
                 self.distribution.add(self.chars_to_indices[LeftContext.UP], 1)
+            elif up_char_coding == UpCharCodingAlrorithm.E_SEE:
+                self.distribution.append(1)  # escape frequency is set by SeeModel right before every use
             else:
                 raise Exception()
         else:
@@ -215,6 +309,18 @@ class LeftContext:
             else:
                 self.distribution.add(char_idx, 1)
 
+    # count for a new context with just the escape, so that c/(c + escape) ~ freq/total of the parent
+    @staticmethod
+    def inherited_count(freq, total):
+        return max(1, min(LeftContext.MAX_INHERITED_COUNT, round(freq / max(total - freq, 1))))
+
+    # B keeps first occurrences outside of the distribution, so there's nothing to scale
+    def add_inherited(self, c, up_char_coding: UpCharCodingAlrorithm, count):
+        self.add(c, up_char_coding)
+        char_idx = self.chars_to_indices.get(c)
+        if char_idx is not None and count > 1:
+            self.distribution.add(char_idx, count - 1)
+
     def get_children(self):
         self._children = self._children or {}
         return self._children
@@ -229,3 +335,39 @@ class LeftContext:
         child = LeftContext(self, c + self.s)
         self.get_children()[c] = child
         return child
+
+
+# Remembers the context each symbol started from and counts created nodes, for CodingStats.
+# Kept as a subclass so that the plain tree doesn't pay for it
+class InstrumentedLeftContextTree(LeftContextTree):
+    coded_match = None  # the tree never predicts by match, see PredictedCharModel
+
+    def __init__(self, coding_params, stats):
+        super().__init__(coding_params)
+        self.stats = stats
+
+        # both describe the context of the last _go_down, i.e. before the tree is updated with the coded char
+        self.coded_order = -1
+        self.coded_deterministic = False
+
+    def ctx_order(self, ctx):
+        return -1 if ctx is self.pseudo_root else len(ctx.s)
+
+    def _go_down(self, left_ctx):
+        ctx = super()._go_down(left_ctx)
+        self.coded_order = self.ctx_order(ctx)
+        self.coded_deterministic = ctx is not self.pseudo_root and ctx.get_char_count() == 1
+        return ctx
+
+    def _extend_down(self, left_ctx):
+        extended_ctx = super()._extend_down(left_ctx)
+        self.stats.node_count += self.ctx_order(extended_ctx) - self.coded_order
+        return extended_ctx
+
+
+# For StatisticEstimator: nothing is projected onto a range, so masked distributions don't have to be real trees,
+# only the coded char's frequency and the total matter (see MaskedFrequencies). Same probabilities, same updates
+class EstimatingLeftContextTree(InstrumentedLeftContextTree):
+    def _masked_distribution(self, encode_ctx, seen_chars, c):
+        masked = MaskedFrequencies(encode_ctx.distribution, seen_chars, encode_ctx.chars_to_indices)
+        return masked, encode_ctx.chars_to_indices.get(c)  # c can't be among seen_chars, it would've been coded
@@ -0,0 +1,56 @@
+import time
+from typing import List, Tuple
+from coding.coding_params import CodingParams
+
+# Deadline mode: the job has to be done in deadline_s (or at some chars/s, which is the same for a known length),
+# and the model gets as rich as that allows. After every segment (see coding/segments.py) the pacer compares
+# the speed of that segment with the speed still needed for the rest of the text and moves one step along
+# levels: cheaper when behind, richer again when there's slack. The level of every segment goes into
+# its SegmentHeader, so the decoder just follows. The decoder isn't paced, it has to follow whatever was chosen
+
+SLACK = 1.5  # faster than needed by this much, and it's time to go richer again
+
+
+# from the configured coding_params down to the cheapest: lower orders first, masking goes last
+def deadline_levels(coding_params: CodingParams) -> List[Tuple[int, bool]]:
+    levels = [(order, coding_params.mask_seen) for order in range(coding_params.context_length, -1, -1)]
+    if coding_params.mask_seen:
+        levels.append((0, False))
+    return levels
+
+
+class DeadlinePacer:
+    def __init__(self, deadline_s, coding_params: CodingParams):
+        self.deadline_s = deadline_s
+        self.levels = deadline_levels(coding_params)
+        self.level_idx = 0
+        self.start_time = time.perf_counter()  # the deadline is for the whole job, header passes included
+        self.length = 0
+        self.done = 0
+
+    @staticmethod
+    def for_throughput(chars_per_s, length, coding_params: CodingParams) -> 'DeadlinePacer':
+        return DeadlinePacer(length / chars_per_s, coding_params)
+
+    def start(self, length):  # chars that go through segments
+        self.length = length
+
+    def level(self) -> Tuple[int, bool]:  # (order, mask_seen) for the next segment
+        return self.levels[self.level_idx]
+
+    # stored segments are counted, but their speed says nothing about the model
+    def segment_done(self, length, elapsed_s, coded):
+        self.done += length
+        if not coded or elapsed_s <= 0:
+            return
+
+        time_left = self.deadline_s - (time.perf_counter() - self.start_time)
+        if time_left <= 0:
+            self.level_idx = len(self.levels) - 1
+            return
+        needed = (self.length - self.done) / time_left
+        speed = length / elapsed_s
+        if speed < needed:
+            self.level_idx = min(self.level_idx + 1, len(self.levels) - 1)
+        elif speed > needed * SLACK:
+            self.level_idx = max(self.level_idx - 1, 0)
@@ -0,0 +1,249 @@
+from array import array
+from typing import Iterable, Tuple, Callable, List, Optional, Dict
+
+from coding.coding_params import UpCharCodingAlrorithm
+from coding.context_tree import confidence_level
+from utils.fenwick_utils import PlainFrequencies
+
+SLOTS = 24  # chars per context; a new char takes the place of the rarest one when all are taken
+MAX_SLOT_COUNT = 4096  # halving the context after that, so that it keeps adapting
+HASH_MULT = 0x01000193
+
+
+# Alternative to LeftContextTree with the same interface: instead of a tree of dicts, every order 1..K has
+# a preallocated table of 2 ** hash_bits entries, addressed by a hash of the last k chars. An entry is a check word
+# and SLOTS (char, count) slots in flat arrays, so memory is fixed up front and finding the contexts of a char
+# is K hash lookups, no walk. Entries come in pairs: a new context takes the pair's entry with fewer counts.
+# Collisions that pass the check, evicted contexts and evicted chars are what it costs: contexts missing
+# from the tables are skipped (both sides skip the same ones), and so are those with every char masked.
+# Order 0 is a plain dict, order -1 is uniform over the alphabet. Escape counts are A (1), C or D (distinct chars)
+class HashedContextTable:
+    def __init__(self, coding_params):
+        if coding_params.up_char_coding in (UpCharCodingAlrorithm.B_OTHER_CHAR_COUNT, UpCharCodingAlrorithm.E_SEE):
+            raise Exception('Hashed context tables support up-char coding A, C and D only')
+        if coding_params.inherit_counts:
+            raise Exception('Hashed context tables can\'t inherit counts, a new context has no parent to take them from')
+        self.coding_params = coding_params
+        self.increment = 2 if coding_params.up_char_coding == UpCharCodingAlrorithm.D_PLUS_HALF_ON_NEW_CHAR else 1
+
+        self.entries = 1 << coding_params.hash_bits
+        orders = coding_params.context_length
+        self.checks = [array('I', bytes(4 * self.entries)) for _ in range(orders)]  # [k - 1], 0 is a free entry
+        self.syms = [bytearray(self.entries * SLOTS) for _ in range(orders)]
+        self.counts = [array('H', bytes(2 * self.entries * SLOTS)) for _ in range(orders)]  # 0 is a free slot
+        self.root_counts: Dict[str, int] = {}
+        self.alphabet = [chr(c) for c in range(256) if not (coding_params.decapitalize and chr(c).isupper())]
+
+        self.left_ctx = ''
+        self.order = orders
+        self.mask_seen = coding_params.mask_seen
+        self.frozen = False  # can't be loaded from a semi-static model
+        self.see = None
+
+    # excluded: a char known not to be c (a PredictedCharModel miss), it gets no probability anywhere
+    def encode(self, c, excluded: Optional[str] = None) -> Iterable[Tuple[PlainFrequencies, int]]:
+        hashes = self._hashes()
+        masked = {excluded} if excluded is not None else set()
+        coded_order = -1
+        for order, chars, distribution in self._distributions(hashes, masked):
+            if c in chars:
+                coded_order = order
+                yield distribution, chars.index(c) + 1
+                break
+            yield distribution, 0
+        else:
+            chars = [a for a in self.alphabet if a not in masked]
+            yield PlainFrequencies([0] + [1] * len(chars)), chars.index(c) + 1
+        self._update(hashes, c, coded_order)
+
+    def decode(self, get_next_char: Callable[[PlainFrequencies], int]) -> Iterable[str]:
+        while True:
+            yield self.decode_next(get_next_char)
+
+    def decode_next(self, get_next_char: Callable[[PlainFrequencies], int], excluded: Optional[str] = None) -> str:
+        hashes = self._hashes()
+        masked = {excluded} if excluded is not None else set()
+        for order, chars, distribution in self._distributions(hashes, masked):
+            char_idx = get_next_char(distribution)
+            if char_idx > 0:
+                char = chars[char_idx - 1]
+                self._update(hashes, char, order)
+                return char
+        chars = [a for a in self.alphabet if a not in masked]
+        char = chars[get_next_char(PlainFrequencies([0] + [1] * len(chars))) - 1]
+        self._update(hashes, char, -1)
+        return char
+
+    def set_order(self, order, mask_seen):
+        self.order = min(order, self.coding_params.context_length)
+        self.mask_seen = mask_seen
+
+    # c was coded by someone else (see LineFieldModel): only moves the context
+    def skip(self, c):
+        self._move(c)
+
+    # c was coded by someone else (see PredictedCharModel), the tables learn it as if they had coded it,
+    # like LeftContextTree.update only down to the longest context that had seen c
+    def update(self, c):
+        hashes = self._hashes()
+        coded_order = 0 if c in self.root_counts else -1
+        for order, h in hashes:
+            entry = self._find(order, h)
+            if entry is not None and self._contains(order, entry, c):
+                coded_order = order
+                break
+        self._update(hashes, c, coded_order, exclusive=True)
+
+    def table_bytes(self):
+        return sum(len(t) * t.itemsize for t in self.checks + self.counts) + sum(map(len, self.syms))
+
+    # (order, hash) from the longest context down, for the orders the current context has
+    def _hashes(self) -> List[Tuple[int, int]]:
+        res = []
+        h = 0
+        left_ctx = self.left_ctx
+        for order in range(1, min(self.order, len(left_ctx)) + 1):
+            h = ((h ^ ord(left_ctx[-order])) * HASH_MULT + order) & 0xFFFFFFFF
+            res.append((order, h or 1))
+        res.reverse()
+        return res
+
+    # (order, chars, distribution) of every context that can code something, longest first; escape is index 0.
+    # Fills masked with the chars of the contexts it went through
+    def _distributions(self, hashes, masked):
+        for order, h in hashes:
+            entry = self._find(order, h)
+            if entry is None:
+                continue
+            base = entry * SLOTS
+            counts = self.counts[order - 1][base:base + SLOTS]
+            syms = self.syms[order - 1][base:base + SLOTS]
+            present = [(chr(sym), count) for sym, count in zip(syms, counts) if count > 0]
+            yield from self._distribution(order, present, masked)
+
+        yield from self._distribution(0, list(self.root_counts.items()), masked)
+
+    def _distribution(self, order, present, masked):
+        chars = [c for c, _ in present if c not in masked]
+        if not chars:
+            return
+        escape = 1 if self.coding_params.up_char_coding == UpCharCodingAlrorithm.A_ALWAYS_ONE else len(present)
+        yield order, chars, PlainFrequencies([escape] + [count for c, count in present if c not in masked])
+        if self.mask_seen:
+            masked.update(chars)
+
+    def _index(self, h):
+        return ((h ^ (h >> 16)) & (self.entries - 1)) & ~1
+
+    def _find(self, order, h) -> Optional[int]:
+        checks = self.checks[order - 1]
+        pair = self._index(h)
+        if checks[pair] == h:
+            return pair
+        if checks[pair + 1] == h:
+            return pair + 1
+        return None
+
+    def _find_or_add(self, order, h) -> int:
+        entry = self._find(order, h)
+        if entry is not None:
+            return entry
+        counts = self.counts[order - 1]
+        pair = self._index(h)
+        entry = pair if sum(counts[pair * SLOTS:(pair + 1) * SLOTS]) <= \
+            sum(counts[(pair + 1) * SLOTS:(pair + 2) * SLOTS]) else pair + 1
+        self.checks[order - 1][entry] = h
+        counts[entry * SLOTS:(entry + 1) * SLOTS] = array('H', bytes(2 * SLOTS))
+        self._on_new_context()
+        return entry
+
+    # see LeftContextTree.confidence; the longest context the tables have
+    def confidence(self, c) -> int:
+        for order, h in self._hashes():
+            entry = self._find(order, h)
+            if entry is None:
+                continue
+            base = entry * SLOTS
+            counts = self.counts[order - 1][base:base + SLOTS]
+            syms = self.syms[order - 1][base:base + SLOTS]
+            freq = sum(count for sym, count in zip(syms, counts) if sym == ord(c) and count > 0)
+            escape = 1 if self.coding_params.up_char_coding == UpCharCodingAlrorithm.A_ALWAYS_ONE \
+                else sum(1 for count in counts if count > 0)
+            return confidence_level(freq, sum(counts) + escape) if freq > 0 else 0
+        freq = self.root_counts.get(c, 0)
+        return confidence_level(freq, sum(self.root_counts.values()) + len(self.root_counts)) if freq > 0 else 0
+
+    def _contains(self, order, entry, c):
+        base = entry * SLOTS
+        counts = self.counts[order - 1]
+        syms = self.syms[order - 1]
+        sym = ord(c)
+        return any(syms[i] == sym and counts[i] > 0 for i in range(base, base + SLOTS))
+
+    def _on_new_context(self):
+        pass
+
+    # like LeftContextTree: every order, or with exclude_on_update only down to the one c was coded in
+    def _update(self, hashes, c, coded_order, exclusive=False):
+        lowest_order = coded_order if exclusive or self.coding_params.exclude_on_update else 0
+        for order, h in hashes:
+            if order < lowest_order:
+                break
+            self._add(order, self._find_or_add(order, h), c)
+        if lowest_order <= 0:
+            self.root_counts[c] = self.root_counts[c] + self.increment if c in self.root_counts else 1
+        self._move(c)
+
+    def _add(self, order, entry, c):
+        counts = self.counts[order - 1]
+        syms = self.syms[order - 1]
+        base = entry * SLOTS
+        sym = ord(c)
+        free, rarest = None, base
+        for i in range(base, base + SLOTS):
+            count = counts[i]
+            if count == 0:
+                if free is None:
+                    free = i
+            elif syms[i] == sym:
+                counts[i] = count + self.increment
+                if counts[i] > MAX_SLOT_COUNT:
+                    for j in range(base, base + SLOTS):
+                        counts[j] = (counts[j] + 1) // 2
+                return
+            elif counts[rarest] == 0 or count < counts[rarest]:
+                rarest = i
+        slot = free if free is not None else rarest
+        syms[slot] = sym
+        counts[slot] = 1
+
+    def _move(self, c):
+        context_length = self.coding_params.context_length
+        self.left_ctx = (self.left_ctx + c)[-context_length:] if context_length > 0 else ''
+
+
+# coded_order/coded_deterministic for CodingStats. Skipped contexts make the per-order numbers approximate:
+# stats count one order down per escape, the table may have gone down more
+class InstrumentedHashedContextTable(HashedContextTable):
+    coded_match = None
+
+    def __init__(self, coding_params, stats):
+        super().__init__(coding_params)
+        self.stats = stats
+        self.coded_order = -1
+        self.coded_deterministic = False
+
+    def _distributions(self, hashes, masked):
+        first = True
+        for order, chars, distribution in super()._distributions(hashes, masked):
+            if first:
+                self.coded_order = order
+                self.coded_deterministic = len(chars) == 1
+                first = False
+            yield order, chars, distribution
+        if first:
+            self.coded_order = -1
+            self.coded_deterministic = False
+
+    def _on_new_context(self):
+        self.stats.node_count += 1
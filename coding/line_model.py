@@ -0,0 +1,127 @@
+import zlib
+from typing import Optional, List, Dict, Tuple, Iterable, Callable
+from fenwick import FenwickTree
+
+from coding.coding_params import UpCharCodingAlrorithm
+from coding.context_tree import LeftContext
+
+FIELD_SEPARATORS = ' \t,;|'
+MAX_FIELD = 31  # field indices and offsets in a field above this share contexts
+MIN_CONTEXT_TOTAL = 8  # distribution total a sparse context needs before it's used
+MAX_ESCAPE_SHARE = 0.1  # ...and at most this much of it may be the escape
+LINE_TABLE_BITS = 16  # (field index, field) -> line slots; a field whose slot is taken by another one replaces it
+
+UP_CHAR_CODING = UpCharCodingAlrorithm.D_PLUS_HALF_ON_NEW_CHAR  # for the sparse contexts, whatever the tree uses
+
+
+# Line-structured text (logs, CSV): a char is often best predicted by the char above it, in the same field
+# of the line above, rather than by the previous K chars (timestamps, counters, column templates).
+# A field ends with a separator (which belongs to the field) or the end of the line, so a field that got a char
+# longer doesn't shift the rest of the line. "The line above" is the previous one until a field turns out
+# different from it: then it's the latest line that had the same field there, if any (e.g. the last line
+# of the same module, with the same message template).
+# Every char first goes to a sparse context (field index, offset in the field, char above, char to the left),
+# with its own adaptive distribution; on an escape it's coded by the tree as usual, like after a
+# PredictedCharModel miss. Sparse contexts that are new or escape often are skipped, the tree codes right away.
+# Chars coded in a sparse context only move the tree's context, which is also what makes the mode faster
+class LineFieldModel:
+    def __init__(self, left_ctx_tree):
+        self.left_ctx_tree = left_ctx_tree
+        self.contexts: Dict[Tuple, LeftContext] = {}
+        self.coded_match: Optional[bool] = None  # for CodingStats: None without a sparse context, False on escape
+
+        self.above: Optional[List[str]] = None  # fields of the line the chars above come from
+        self.fields: List[str] = []  # finished fields of the current line
+        self.field: List[str] = []  # chars of the current field so far
+        # latest line with (field index, field), or None: slot by a hash of both, the key is kept to check it
+        self.lines_by_field: List[Optional[Tuple[int, str, List[str]]]] = [None] * (1 << LINE_TABLE_BITS)
+        self.left = '\n'
+
+    @property
+    def coded_order(self):
+        return self.left_ctx_tree.coded_order
+
+    @property
+    def coded_deterministic(self):
+        return self.left_ctx_tree.coded_deterministic
+
+    def encode(self, c) -> Iterable[Tuple[FenwickTree, int]]:
+        key = self._key()
+        ctx = self._usable(key)
+        if ctx is None:
+            self.coded_match = None
+            yield from self.left_ctx_tree.encode(c)
+        else:
+            char_idx = ctx.chars_to_indices.get(c)
+            self.coded_match = char_idx is not None
+            yield ctx.distribution, char_idx if char_idx is not None else ctx.chars_to_indices[LeftContext.UP]
+            if char_idx is None:
+                yield from self.left_ctx_tree.encode(c)
+            else:
+                self.left_ctx_tree.skip(c)
+        self._update(key, c)
+
+    def decode(self, get_next_char: Callable[[FenwickTree], int]) -> Iterable[str]:
+        while True:
+            key = self._key()
+            ctx = self._usable(key)
+            if ctx is None:
+                self.coded_match = None
+                char = self.left_ctx_tree.decode_next(get_next_char)
+            else:
+                char = ctx.indices_to_chars[get_next_char(ctx.distribution)]
+                self.coded_match = char != LeftContext.UP
+                if char == LeftContext.UP:
+                    char = self.left_ctx_tree.decode_next(get_next_char)
+                else:
+                    self.left_ctx_tree.skip(char)
+            self._update(key, char)
+            yield char
+
+    def _key(self):
+        above_char = None
+        if self.above is not None and len(self.fields) < len(self.above):
+            above_field = self.above[len(self.fields)]
+            above_char = above_field[len(self.field)] if len(self.field) < len(above_field) else None
+        return min(len(self.fields), MAX_FIELD), min(len(self.field), MAX_FIELD), above_char, self.left
+
+    def _usable(self, key) -> Optional[LeftContext]:
+        ctx = self.contexts.get(key)
+        if ctx is None:
+            return None
+        total = ctx.distribution.prefix_sum(len(ctx.distribution))
+        if total < MIN_CONTEXT_TOTAL or ctx.distribution[0] > MAX_ESCAPE_SHARE * total:
+            return None
+        return ctx
+
+    def _update(self, key, c):
+        ctx = self.contexts.get(key)
+        if ctx is None:
+            ctx = self.contexts[key] = LeftContext(None, '')
+        ctx.add(c, UP_CHAR_CODING)
+
+        self.left = c
+        self.field.append(c)
+        if c == '\n':
+            self._end_field()
+            for i, field in enumerate(self.fields):
+                self.lines_by_field[self._line_slot(i, field)] = i, field, self.fields
+            self.above = self.fields
+            self.fields = []
+        elif c in FIELD_SEPARATORS:
+            self._end_field()
+
+    def _end_field(self):
+        field = ''.join(self.field)
+        i = len(self.fields)
+        if self.above is not None and (i >= len(self.above) or self.above[i] != field):
+            entry = self.lines_by_field[self._line_slot(i, field)]
+            if entry is not None and entry[0] == i and entry[1] == field:
+                self.above = entry[2]
+        self.fields.append(field)
+        self.field = []
+
+    # not hash(): str hashes differ between processes, the encoder and the decoder must evict the same lines
+    @staticmethod
+    def _line_slot(i, field) -> int:
+        return zlib.crc32(field.encode('latin-1'), i) & ((1 << LINE_TABLE_BITS) - 1)
@@ -0,0 +1,153 @@
+from abc import ABC, abstractmethod
+from array import array
+from typing import Iterable, Tuple, Callable, Optional
+from fenwick import FenwickTree
+
+from utils.fenwick_utils import ExtendableFenwickTree
+
+FLAG_BUCKETS = 16
+CONFIDENCE_LEVELS = 4  # see LeftContextTree.confidence: flags are also per how sure the tree is of the prediction
+MAX_FLAG_TOTAL = 1024  # halving after that, so that the flags keep adapting
+
+HIT = 0
+MISS = 1
+
+MATCH_HASH_BITS = 18  # MatchModel remembers 2^18 positions, newer ones take the place of older ones
+HASH_MULT = 0x01000193
+
+
+# Something in front of LeftContextTree that sometimes knows the next char (or is at least pretty sure).
+# While the prediction holds, a char costs one binary flag, and the tree still learns it, so that its statistics
+# are up to date when the prediction fails; on a miss the char is coded by the tree without the predicted char,
+# which is known not to be it. Same encode/decode interface as LeftContextTree, so the codec doesn't care
+# which one it drives
+class PredictedCharModel(ABC):
+    def __init__(self, left_ctx_tree):
+        self.left_ctx_tree = left_ctx_tree
+        self.flag_distributions = [PredictedCharModel._initial_flag_distribution()
+                                   for _ in range(FLAG_BUCKETS * CONFIDENCE_LEVELS)]
+        self.coded_match: Optional[bool] = None  # None if the last char had no prediction
+
+    # for CodingStats, meaningless when the last char was a hit
+    @property
+    def coded_order(self):
+        return self.left_ctx_tree.coded_order
+
+    @property
+    def coded_deterministic(self):
+        return self.left_ctx_tree.coded_deterministic
+
+    def encode(self, c) -> Iterable[Tuple[FenwickTree, int]]:
+        predicted = self._predicted()
+        if predicted is None:
+            self.coded_match = None
+            yield from self.left_ctx_tree.encode(c)
+        else:
+            hit = c == predicted
+            self.coded_match = hit
+            key = self._flag_key(predicted)
+            yield self.flag_distributions[key], HIT if hit else MISS
+            self._update_flag(key, hit)
+            if hit:
+                self.left_ctx_tree.update(c)
+            else:
+                yield from self.left_ctx_tree.encode(c, excluded=predicted)
+        self._update_history(c)
+
+    def decode(self, get_next_char: Callable[[FenwickTree], int]) -> Iterable[str]:
+        while True:
+            predicted = self._predicted()
+            if predicted is None:
+                self.coded_match = None
+                char = self.left_ctx_tree.decode_next(get_next_char)
+            else:
+                key = self._flag_key(predicted)
+                hit = get_next_char(self.flag_distributions[key]) == HIT
+                self.coded_match = hit
+                self._update_flag(key, hit)
+                if hit:
+                    char = predicted
+                    self.left_ctx_tree.update(char)
+                else:
+                    char = self.left_ctx_tree.decode_next(get_next_char, excluded=predicted)
+            self._update_history(char)
+            yield char
+
+    @abstractmethod
+    def _predicted(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def _flag_bucket(self) -> int:  # < FLAG_BUCKETS
+        pass
+
+    @abstractmethod
+    def _update_history(self, c):
+        pass
+
+    # a hit costs little where the tree is sure of the prediction anyway, and a miss there tells more
+    def _flag_key(self, predicted):
+        return self._flag_bucket() * CONFIDENCE_LEVELS + self.left_ctx_tree.confidence(predicted)
+
+    def _update_flag(self, key, hit):
+        distribution = self.flag_distributions[key]
+        distribution.add(HIT if hit else MISS, 1)
+        if distribution.prefix_sum(2) > MAX_FLAG_TOTAL:
+            halved = ExtendableFenwickTree(2)
+            for i in (HIT, MISS):
+                halved.add(i, (distribution[i] + 1) // 2)
+            self.flag_distributions[key] = halved
+
+    @staticmethod
+    def _initial_flag_distribution():
+        distribution = ExtendableFenwickTree(2)
+        distribution.add(HIT, 1)
+        distribution.add(MISS, 1)
+        return distribution
+
+
+# Long-range repeats: remembers where the last min_match_length chars were seen, in a fixed-size table indexed
+# by their rolling hash, and once they were seen before (checked against the history, the hash may collide),
+# predicts that the char after them repeats too
+class MatchModel(PredictedCharModel):
+    def __init__(self, left_ctx_tree, min_match_length):
+        super().__init__(left_ctx_tree)
+        self.min_match_length = min_match_length
+
+        self.history = bytearray()
+        self.positions = array('I', bytes(4 << MATCH_HASH_BITS))  # hash -> position right after them, 0 if none
+        self.hash = 0  # of the last min_match_length bytes
+        self.oldest_mult = pow(HASH_MULT, min_match_length - 1, 1 << 32)  # what the byte leaving the window weighs
+        self.match_ptr = None
+        self.match_length = 0
+
+    def _predicted(self) -> Optional[str]:
+        return chr(self.history[self.match_ptr]) if self.match_ptr is not None else None
+
+    # per verified match length, longer matches are much more likely to go on
+    def _flag_bucket(self):
+        return min(self.match_length.bit_length(), FLAG_BUCKETS - 1)
+
+    def _update_history(self, c):
+        if self.match_ptr is not None and self.history[self.match_ptr] == ord(c):
+            self.match_ptr += 1
+            self.match_length += 1
+        else:
+            self.match_ptr = None
+            self.match_length = 0
+
+        history = self.history
+        n = self.min_match_length
+        if len(history) >= n:
+            self.hash = (self.hash - history[-n] * self.oldest_mult) & 0xFFFFFFFF
+        self.hash = (self.hash * HASH_MULT + ord(c)) & 0xFFFFFFFF
+        history.append(ord(c))
+        if len(history) < n:
+            return
+
+        idx = (self.hash ^ (self.hash >> MATCH_HASH_BITS)) & ((1 << MATCH_HASH_BITS) - 1)
+        if self.match_ptr is None:
+            candidate = self.positions[idx]
+            if candidate > 0 and history[candidate - n:candidate] == history[-n:]:
+                self.match_ptr = candidate
+        self.positions[idx] = len(history)
@@ -0,0 +1,102 @@
+import io
+import zlib
+from typing import Iterable, Optional
+from coding.codec import StatisticEncoder, StatisticDecoder
+from coding.coding_params import CodingParams
+from coding.segments import is_incompressible
+from headers.checksum_trailer import ChecksumTrailer, ChecksumError
+from headers.header import Header
+from headers.segment_header import SegmentKind, SegmentHeader
+from utils.iter_utils import iter_bits, bits_to_bytes
+
+# Message streams: for RPC-like traffic, where the receiver must get message N as soon as its bytes arrive,
+# not when the coder happens to push the next bits out. Every message is coded and then sync-flushed
+# (StatisticEncoder.sync_flush), so it ends on a byte boundary and is decodable from its own bytes.
+# The model is shared by the whole stream, so later messages are still predicted from the earlier ones.
+# Layout: Header (length is 0, it isn't known up front), then a SegmentHeader + data + ChecksumTrailer per message,
+# then a SegmentHeader of kind END. Decapitalization, the word dictionary and the semi-static model need
+# the whole text up front, so a message stream can't have them.
+# The crc32 is per message, not one for the stream: every message is checked before it's handed out
+
+
+class MessageEncoder:
+    def __init__(self, dest_f, coding_params: CodingParams = CodingParams()):
+        if coding_params.decapitalize or coding_params.word_dictionary or coding_params.semi_static:
+            raise Exception('Decapitalization, word dictionary and semi-static model need the whole text, '
+                            'can\'t code messages')
+        self.dest_f = dest_f
+        self.coding_params = coding_params
+        self.encoder = StatisticEncoder(None, coding_params)
+        self.closed = False
+        self._write(Header(0, coding_params).serialize())
+
+    # message is iso-8859-1 bytes; once this returns, everything needed to decode it has been written
+    def send(self, message: bytes):
+        if self.closed:
+            raise Exception('Message stream is closed')
+        chars = message.decode('iso-8859-1')
+        if self.coding_params.stored_segments and is_incompressible(chars):
+            kind, data = SegmentKind.STORED, bytes(message)
+        else:
+            kind, data = SegmentKind.CODED, bits_to_bytes(self.encoder.encode_segment(chars))
+        tree = self.encoder.left_ctx_tree
+        self._write(SegmentHeader(kind, len(chars), len(data), tree.order, tree.mask_seen).serialize() + data +
+                    ChecksumTrailer(zlib.crc32(message)).serialize())
+
+    def close(self):
+        if not self.closed:
+            tree = self.encoder.left_ctx_tree
+            self._write(SegmentHeader(SegmentKind.END, 0, 0, tree.order, tree.mask_seen).serialize())
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def _write(self, b):
+        self.dest_f.write(b)
+        flush = getattr(self.dest_f, 'flush', None)
+        if flush is not None:
+            flush()
+
+
+# Messages as they come: reads exactly one message worth of bytes before yielding it,
+# so input_f may be a socket/pipe that the sender keeps open
+def iter_messages(input_f) -> Iterable[bytes]:
+    header = Header.deserialize(_read_exactly(input_f, Header.header_length()))
+    decoder = StatisticDecoder(None, 0, header.coding_params)
+    while True:
+        message = _decode_message(decoder, input_f)
+        if message is None:
+            return
+        yield message
+
+
+def _decode_message(decoder: StatisticDecoder, input_f) -> Optional[bytes]:
+    segment = SegmentHeader.deserialize(_read_exactly(input_f, SegmentHeader.header_length()))
+    if segment.kind == SegmentKind.END:
+        return None
+    data = _read_exactly(input_f, segment.coded_length)
+    trailer = ChecksumTrailer.deserialize(_read_exactly(input_f, ChecksumTrailer.trailer_length()))
+    if segment.kind == SegmentKind.STORED:
+        message = data
+    else:
+        decoder.left_ctx_tree.set_order(segment.order, segment.mask_seen)
+        message = ''.join(decoder.decode_segment(iter_bits(io.BytesIO(data)), segment.length)).encode('iso-8859-1')
+    if zlib.crc32(message) != trailer.crc32:
+        raise ChecksumError(f'Message checksum mismatch: stored {trailer.crc32:08x}, '
+                            f'decoded {zlib.crc32(message):08x}')
+    return message
+
+
+def _read_exactly(input_f, n) -> bytes:
+    res = b''
+    while len(res) < n:
+        chunk = input_f.read(n - len(res))
+        if not chunk:
+            raise Exception('Message stream ends in the middle of a message')
+        res += chunk
+    return res
@@ -0,0 +1,188 @@
+from array import array
+from typing import Iterable, Tuple, Callable, List, Optional
+
+from coding.coding_params import UpCharCodingAlrorithm
+from coding.context_tree import LeftContextTree, LeftContext
+from utils.fenwick_utils import PlainFrequencies
+
+PROB_BITS = 12  # bit probabilities are ints in (0, 4096)
+PROB_ONE = 1 << PROB_BITS
+BIT_MODEL_RATE = 3  # order-1/order-2 bit models move 1/8 of the way to every coded bit
+WEIGHT_ONE = 1 << 16  # mixer weights are 16.16 fixed point
+LEARNING_SHIFT = 11  # weight step is (stretched input * error) >> this
+BIAS_INPUT = 256
+INPUTS = 4  # PPM, order 1, order 2, bias
+APM_BUCKETS = 33  # of the stretched mixer output, interpolated between two
+APM_RATE = 5
+ORDER2_CONTEXT_BITS = 14  # order-2 contexts hash into 2 ** this rows of 256 bit models (8MB), not one row per pair
+PPM_PROB_BITS = 48  # the PPM char distribution is in fixed point too, chars get at least 1
+
+# squash(d) = 4096 / (1 + e^(-d / 256)), interpolated between 33 points, and stretch is its inverse.
+# Integers only, so that the encoder and the decoder get the same bits on any platform (libm may differ)
+_SQUASH_POINTS = [1, 2, 3, 6, 10, 16, 27, 45, 73, 120, 194, 310, 488, 747, 1101, 1546, 2047, 2549, 2994, 3348, 3607,
+                  3785, 3901, 3975, 4022, 4050, 4068, 4079, 4085, 4089, 4092, 4093, 4094]
+
+
+def squash(d) -> int:
+    if d > 2047:
+        return PROB_ONE - 1
+    if d < -2047:
+        return 1
+    w = d & 127
+    i = (d >> 7) + 16
+    return (_SQUASH_POINTS[i] * (128 - w) + _SQUASH_POINTS[i + 1] * w + 64) >> 7
+
+
+def _stretch_table() -> List[int]:
+    table = [0] * PROB_ONE
+    pi = 0
+    for d in range(-2047, 2048):
+        p = squash(d)
+        for i in range(pi, p + 1):
+            table[i] = d
+        pi = p + 1
+    for i in range(pi, PROB_ONE):
+        table[i] = 2047
+    return table
+
+
+STRETCH = _stretch_table()
+
+
+# Logistic mixing (PAQ-style) of the PPM prediction with direct-indexed order-1 and order-2 models.
+# A char is coded as 8 binary decisions, high bit first. For every bit, the inputs are:
+# - PPM: the full char distribution of the tree (escape probabilities times the masked frequencies of every context
+#   from the longest one down, order -1 gets what's left), summed over the chars that agree with the bits so far;
+# - order 1 and order 2: a 12-bit probability per (previous chars, bits so far), one array each; order 2 rows are
+#   shared by the pairs of previous chars that hash to the same row;
+# they are mixed in the stretched domain by a weight set chosen by the order of the longest PPM context and the bit,
+# and the weights learn from every bit. PPM starts with weight 1, so the mix starts as plain PPM.
+# The mix then goes through an APM (adaptive probability map: what the mixer's probabilities turned out to mean,
+# per previous char and bits so far), and the coded probability is 1/4 mix + 3/4 APM.
+# After the char, the tree learns it like it would've after coding it, and every bit model learns its bit.
+# Needs every char's frequency in every context, so A, C and D only (B keeps chars outside the distribution,
+# E sets the escape in the coding walk); masking is always on for the PPM input, it costs nothing here
+class MixingModel:
+    coded_match = None  # for CodingStats, see CodingParams.mixing there
+
+    def __init__(self, left_ctx_tree: LeftContextTree, coding_params):
+        if coding_params.up_char_coding in (UpCharCodingAlrorithm.B_OTHER_CHAR_COUNT, UpCharCodingAlrorithm.E_SEE):
+            raise Exception('Mixing supports up-char coding A, C and D only')
+        if coding_params.hash_bits > 0 or coding_params.semi_static:
+            raise Exception('Mixing needs a context tree that learns, not hashed tables or a semi-static model')
+        self.left_ctx_tree = left_ctx_tree
+        # [previous chars][bits so far with a leading 1]
+        self.order1 = array('H', [PROB_ONE // 2]) * (256 * 256)
+        self.order2 = array('H', [PROB_ONE // 2]) * (256 << ORDER2_CONTEXT_BITS)
+        self.apm = array('H', [squash((i - APM_BUCKETS // 2) * 128) for i in range(APM_BUCKETS)]) * (256 * 256)
+        # [longest order + 1][bit][input]
+        self.weights = [WEIGHT_ONE] + [0] * (INPUTS - 1)
+        self.weights *= (coding_params.context_length + 2) * 8
+        self.c1 = 0
+        self.order2_row = 0  # of the last two chars
+
+        # for CodingStats: the order PPM would've coded the char in, and if its longest context had one char
+        self.coded_order = -1
+        self.coded_deterministic = False
+
+    def encode(self, c) -> Iterable[Tuple[PlainFrequencies, int]]:
+        probs, ctxs, weights_base = self._ppm()
+        code = ord(c)
+        lo = 0
+        node = 1
+        for k in range(7, -1, -1):
+            bit = (code >> k) & 1
+            p, state = self._predict(probs, lo, k, node, weights_base + INPUTS * k)
+            yield PlainFrequencies([PROB_ONE - p, p]), bit
+            self._update(state, bit)
+            lo += bit << k
+            node = node * 2 + bit
+        self._learn(c, ctxs)
+
+    def decode(self, get_next_char: Callable[[PlainFrequencies], int]) -> Iterable[str]:
+        while True:
+            probs, ctxs, weights_base = self._ppm()
+            lo = 0
+            node = 1
+            for k in range(7, -1, -1):
+                p, state = self._predict(probs, lo, k, node, weights_base + INPUTS * k)
+                bit = get_next_char(PlainFrequencies([PROB_ONE - p, p]))
+                self._update(state, bit)
+                lo += bit << k
+                node = node * 2 + bit
+            char = chr(lo)
+            self._learn(char, ctxs)
+            yield char
+
+    # probability of every char code by the tree, the contexts it went through, and the mixer's weight sets
+    def _ppm(self) -> Tuple[List[int], List[LeftContext], int]:
+        tree = self.left_ctx_tree
+        ctx = tree._go_down(tree._order_ctx())
+        char_probs = {}
+        ctxs = []
+        escape = 1 << PPM_PROB_BITS
+        while ctx is not tree.pseudo_root:
+            ctxs.append(ctx)
+            indices_to_chars = ctx.indices_to_chars
+            freqs = ctx.distribution.inner.frequencies()[:len(ctx.distribution)]
+            unmasked = [(indices_to_chars[i], freq) for i, freq in enumerate(freqs) if i > 0
+                        and indices_to_chars[i] not in char_probs]
+            total = freqs[0] + sum(freq for _, freq in unmasked)
+            for char, freq in unmasked:
+                char_probs[char] = max(escape * freq // total, 1)
+            escape = escape * freqs[0] // total
+            ctx = ctx.parent
+
+        probs = [max(escape // max(LeftContextTree.SIGMA - len(char_probs), 1), 1)] * LeftContextTree.SIGMA
+        for char, prob in char_probs.items():
+            probs[ord(char)] = prob
+
+        self.coded_deterministic = len(ctxs) > 0 and ctxs[0].get_char_count() == 1
+        longest_order = len(ctxs[0].s) if ctxs else -1
+        return probs, ctxs, (longest_order + 1) * 8 * INPUTS
+
+    # probability of a 1 for the bit k of the char, whose higher bits are lo (and node, with a leading 1),
+    # and what _update needs to learn the bit
+    def _predict(self, probs, lo, k, node, weights_base):
+        mid = lo + (1 << k)
+        p1 = sum(probs[mid:mid + (1 << k)])
+        p_ppm = min(max((p1 << PROB_BITS) // (p1 + sum(probs[lo:mid])), 1), PROB_ONE - 1)
+
+        order1_idx = (self.c1 << 8) + node
+        order2_idx = self.order2_row + node
+        inputs = (STRETCH[p_ppm], STRETCH[self.order1[order1_idx]], STRETCH[self.order2[order2_idx]], BIAS_INPUT)
+        w = self.weights
+        dot = w[weights_base] * inputs[0] + w[weights_base + 1] * inputs[1] + w[weights_base + 2] * inputs[2] + \
+            w[weights_base + 3] * inputs[3]
+        p_mix = min(max(squash(dot >> 16), 1), PROB_ONE - 1)
+
+        stretched = STRETCH[p_mix] + 2048
+        apm_idx = order1_idx * APM_BUCKETS + (stretched >> 7)
+        apm_w = stretched & 127
+        p_apm = (self.apm[apm_idx] * (128 - apm_w) + self.apm[apm_idx + 1] * apm_w) >> 7
+        p = min(max((p_mix + 3 * p_apm) >> 2, 1), PROB_ONE - 1)
+        # the APM learns in the nearer of the two buckets
+        return p, (inputs, p_mix, weights_base, order1_idx, order2_idx, apm_idx + (apm_w >> 6))
+
+    def _update(self, state, bit):
+        inputs, p_mix, weights_base, order1_idx, order2_idx, apm_idx = state
+        target = bit << PROB_BITS
+        err = target - p_mix
+        w = self.weights
+        for i, x in enumerate(inputs):
+            w[weights_base + i] += (x * err) >> LEARNING_SHIFT
+        self.order1[order1_idx] += (target - self.order1[order1_idx]) >> BIT_MODEL_RATE
+        self.order2[order2_idx] += (target - self.order2[order2_idx]) >> BIT_MODEL_RATE
+        self.apm[apm_idx] += (target - self.apm[apm_idx]) >> APM_RATE
+
+    # the tree learns c as if it had coded it (encoding context for exclude_on_update is where it would've been)
+    def _learn(self, c, ctxs: List[LeftContext]):
+        tree = self.left_ctx_tree
+        encoding_ctx: Optional[LeftContext] = next((ctx for ctx in ctxs if c in ctx.chars_to_indices), None)
+        self.coded_order = len(encoding_ctx.s) if encoding_ctx is not None else -1
+        tree._update_tree(tree._order_ctx(), c, encoding_ctx if encoding_ctx is not None else tree.pseudo_root,
+                          ctxs[0] if ctxs else tree.pseudo_root)
+        tree.skip(c)
+        c2 = self.c1
+        self.c1 = ord(c)
+        self.order2_row = ((((c2 << 8) + self.c1) * 0x9E3779B1) & 0xFFFFFFFF) >> (32 - ORDER2_CONTEXT_BITS) << 8
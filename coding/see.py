@@ -0,0 +1,64 @@
+from typing import Optional
+
+# Secondary escape estimation: escape frequency of a context is predicted from a small adaptive table
+# indexed by context features instead of being counted in the context itself (UpCharCodingAlrorithm.E_SEE).
+# Encoder and decoder see the same contexts in the same order, so both tables learn the same thing
+
+ORDER_BUCKETS = 6
+CHAR_COUNT_BUCKETS = 6
+TOTAL_BUCKETS = 8
+PREV_CHAR_CLASSES = 6
+
+MAX_SEEN = 1024  # halving after that, so that the table keeps adapting
+
+
+def char_count_bucket(char_count):
+    if char_count < 4:
+        return char_count
+    return 4 if char_count < 8 else 5
+
+
+def prev_char_class(left_ctx):
+    if len(left_ctx) == 0:
+        return 0
+    c = left_ctx[-1]
+    if c.isalpha():
+        return 1 if c.islower() else 2
+    if c.isdigit():
+        return 3
+    return 4 if c.isspace() else 5
+
+
+class SeeModel:
+    def __init__(self):
+        size = ORDER_BUCKETS * CHAR_COUNT_BUCKETS * TOTAL_BUCKETS * PREV_CHAR_CLASSES
+        self.escapes = [1] * size
+        self.seen = [2] * size
+
+    # Overwrites the escape (index 0) frequency of distribution, returns the table key for update().
+    # No key when every char is masked: escape is the only option then and teaches nothing
+    def set_escape_freq(self, distribution, order, char_count, left_ctx) -> Optional[int]:
+        old_escape_freq = distribution[0]
+        total = distribution.prefix_sum(len(distribution)) - old_escape_freq
+        if total == 0:
+            distribution.add(0, 1 - old_escape_freq)
+            return None
+
+        key = ((min(order, ORDER_BUCKETS - 1) * CHAR_COUNT_BUCKETS + char_count_bucket(char_count))
+               * TOTAL_BUCKETS + min(total.bit_length(), TOTAL_BUCKETS - 1)) * PREV_CHAR_CLASSES \
+            + prev_char_class(left_ctx)
+
+        escapes = self.escapes[key]
+        not_escapes = self.seen[key] - escapes
+        escape_freq = max(1, total * (2 * escapes + 1) // (2 * not_escapes + 1))
+        distribution.add(0, escape_freq - old_escape_freq)
+        return key
+
+    def update(self, key: Optional[int], escaped):
+        if key is None:
+            return
+        self.escapes[key] += escaped
+        self.seen[key] += 1
+        if self.seen[key] > MAX_SEEN:
+            self.escapes[key] = (self.escapes[key] + 1) // 2
+            self.seen[key] = (self.seen[key] + 1) // 2
@@ -0,0 +1,124 @@
+import io
+import math
+import time
+import collections
+from typing import Iterable, Tuple, Optional
+from coding.codec import StatisticEncoder, StatisticDecoder, StatisticEstimator
+from coding.deadline import DeadlinePacer
+from headers.segment_header import SegmentKind, SegmentHeader
+from utils.iter_utils import iter_bits, write_bits, iter_str_chunks
+
+# Compressed/encrypted/random stretches of the input only cost CPU in the model and come out bigger than they were.
+# With CodingParams.stored_segments the text is cut into segments, and the ones whose order-0 entropy is
+# close to 8 bits/char are written as is: the model doesn't see them at all (the context goes on from the last
+# coded char), the decoder copies them through. Coded segments end their bits (see encode_segment),
+# so every segment starts on a byte of its own. Each segment also says which max order and masking it is coded
+# with, deadline mode (coding/deadline.py) changes them between segments; it cuts the text with
+# CodingParams.segmented, which doesn't store anything by itself.
+# Semi-static streams (coding/semi_static.py) are segmented too, their segments start from an empty context.
+# The entropy check misses segments that are only partly incompressible, so a coded segment that came out longer
+# than its chars is stored too; the model has learned it by then, so the decoder runs the chars through its model
+# as well (SegmentKind.STORED_LEARNED)
+
+SEGMENT_LENGTH = 16 * 1024  # chars
+STORED_ENTROPY = 7.5  # bits/char; plain text is ~4.5-5, compressed data ~7.99
+
+
+def is_incompressible(chunk: str) -> bool:
+    length = len(chunk)
+    entropy = -sum(count / length * math.log2(count / length) for count in collections.Counter(chunk).values())
+    return entropy > STORED_ENTROPY
+
+
+def iter_segments(iter_char: Iterable[str], detect_stored=True) -> Iterable[Tuple[SegmentKind, str]]:
+    for chunk in iter_str_chunks(iter_char, SEGMENT_LENGTH):
+        yield (SegmentKind.STORED if detect_stored and is_incompressible(chunk) else SegmentKind.CODED), chunk
+
+
+def encode_segments(encoder: StatisticEncoder, iter_char: Iterable[str], dest_f, pacer: Optional[DeadlinePacer] = None):
+    stats = encoder.stats
+    if stats is not None:
+        stats.start()
+    tree = encoder.left_ctx_tree
+    for kind, chunk in iter_segments(iter_char, encoder.coding_params.stored_segments):
+        t0 = time.perf_counter()
+        if pacer is not None:
+            tree.set_order(*pacer.level())
+        if tree.frozen:
+            tree.left_ctx = ''
+        if kind == SegmentKind.STORED:
+            data = chunk.encode('iso-8859-1')
+            if stats is not None:
+                stats.record_stored(len(chunk))
+        else:
+            bits_f = io.BytesIO()
+            write_bits(encoder.encode_segment(chunk), bits_f)
+            data = bits_f.getvalue()
+            if encoder.coding_params.stored_segments and len(data) > len(chunk):
+                kind, data = SegmentKind.STORED_LEARNED, chunk.encode('iso-8859-1')
+        dest_f.write(SegmentHeader(kind, len(chunk), len(data), tree.order, tree.mask_seen).serialize())
+        dest_f.write(data)
+        if pacer is not None:
+            pacer.segment_done(len(chunk), time.perf_counter() - t0, kind != SegmentKind.STORED)
+    if stats is not None:
+        stats.finish(encoder.left_ctx_tree)
+
+
+def decode_segments(decoder: StatisticDecoder, input_f, length) -> Iterable[str]:
+    stats = decoder.stats
+    if stats is not None:
+        stats.start()
+    for segment, data in iter_segment_frames(input_f, length):
+        yield from decode_segment(decoder, segment, data)
+    if stats is not None:
+        stats.finish(decoder.left_ctx_tree)
+
+
+# (header, data) of every segment up to length chars, nothing is decoded
+def iter_segment_frames(input_f, length) -> Iterable[Tuple[SegmentHeader, bytes]]:
+    decoded = 0
+    while decoded < length:
+        segment = SegmentHeader.deserialize(input_f.read(SegmentHeader.header_length()))
+        data = input_f.read(segment.coded_length)
+        if len(data) != segment.coded_length:
+            raise Exception('Stream ends in the middle of a segment')
+        yield segment, data
+        decoded += segment.length
+
+
+def decode_segment(decoder: StatisticDecoder, segment: SegmentHeader, data: bytes) -> Iterable[str]:
+    tree = decoder.left_ctx_tree
+    if segment.kind == SegmentKind.STORED:
+        if decoder.stats is not None:
+            decoder.stats.record_stored(segment.length)
+        yield from data.decode('iso-8859-1')
+        return
+    tree.set_order(segment.order, segment.mask_seen)
+    if tree.frozen:
+        tree.left_ctx = ''
+    if segment.kind == SegmentKind.STORED_LEARNED:
+        chars = data.decode('iso-8859-1')
+        decoder.learn_segment(chars)
+        yield from chars
+        return
+    yield from decoder.decode_segment(iter_bits(io.BytesIO(data)), segment.length)
+
+
+# bytes encode_segments would write
+def estimate_segments(estimator: StatisticEstimator, iter_char: Iterable[str]) -> int:
+    stats = estimator.stats
+    stats.start()
+    total = 0
+    for kind, chunk in iter_segments(iter_char, estimator.coding_params.stored_segments):
+        if estimator.left_ctx_tree.frozen:
+            estimator.left_ctx_tree.left_ctx = ''
+        if kind == SegmentKind.STORED:
+            stats.record_stored(len(chunk))
+            total += len(chunk)
+        elif estimator.coding_params.stored_segments:
+            total += min(math.ceil(estimator.estimate_segment(chunk) / 8), len(chunk))  # see STORED_LEARNED
+        else:
+            total += math.ceil(estimator.estimate_segment(chunk) / 8)
+        total += SegmentHeader.header_length()
+    stats.finish(estimator.left_ctx_tree)
+    return total
@@ -0,0 +1,132 @@
+import collections
+import math
+import os
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional
+from coding.coding_params import CodingParams
+from coding.codec import StatisticDecoder
+from coding.context_tree import LeftContextTree, LeftContext
+from coding.segments import decode_segment, iter_segment_frames
+from headers.segment_header import SegmentHeader
+from utils.fenwick_utils import ExtendableFenwickTree
+
+# Semi-static mode: a first pass counts what follows every context up to context_length over the whole text,
+# the counts go into a header (pruned and quantized), and the text is then coded in segments against that frozen
+# model. Nothing is learnt while coding and every segment starts from an empty context, so any segment
+# decodes on its own, with full-file statistics (see decode_segments_parallel).
+# Costs: the model is paid for in the archive, so only contexts that save more than they take are kept,
+# and the first few chars of every segment are coded in short contexts
+
+MIN_CONTEXT_COUNT = 8  # rarer contexts can't pay for themselves
+MIN_CHAR_COUNT = 2  # rarer chars of a context are left to its escape (and so to shorter contexts)
+QUANT_STEPS = 16  # quantized counts per doubling: 1 byte holds counts up to ~2^16 within ~2%
+MAX_QUANTIZED = 255
+# header bits of a stored context, see SemiStaticHeader: its first char, escape, child count,
+# a bitmap bit per char of the parent and a quantized count per char of its own
+CONTEXT_COST_BITS = 4 * 8
+CHAR_COST_BITS = 8
+IN_FLIGHT_PER_WORKER = 2  # segments read ahead per decoding process
+
+
+@dataclass
+class SemiStaticModel:
+    # context -> quantized count per char; the escape is under LeftContext.UP. '' is order 0 and has every char
+    contexts: Dict[str, Dict[str, int]]
+
+
+def quantize(count) -> int:
+    return min(round(QUANT_STEPS * math.log2(count)) + 1, MAX_QUANTIZED)
+
+
+def dequantize(q) -> int:
+    return round(2 ** ((q - 1) / QUANT_STEPS))
+
+
+# iter_text is what the model sees, i.e. after decapitalization and the word dictionary
+def build_semi_static_model(iter_text: Iterable[str], coding_params: CodingParams) -> SemiStaticModel:
+    if coding_params.match_length > 0 or coding_params.unbounded_order or coding_params.line_contexts:
+        raise Exception('Match model, unbounded and line contexts learn while coding, they can\'t be semi-static')
+    if coding_params.hash_bits > 0:
+        raise Exception('Semi-static model is loaded into a context tree, hashed tables can\'t hold it')
+
+    counts: Dict[str, Dict[str, int]] = {'': {}}
+    left_ctx = ''
+    for c in iter_text:
+        for order in range(len(left_ctx) + 1):
+            ctx_counts = counts.setdefault(left_ctx[order:], {})
+            ctx_counts[c] = ctx_counts.get(c, 0) + 1
+        left_ctx = (left_ctx + c)[-coding_params.context_length:] if coding_params.context_length > 0 else ''
+
+    contexts = {'': _quantized(counts[''], 1, 0)}
+    for ctx in sorted(counts, key=len):
+        if ctx == '' or ctx[1:] not in contexts:  # a context is kept only with its parent, the tree has no gaps
+            continue
+        ctx_counts = counts[ctx]
+        kept = {c: count for c, count in ctx_counts.items() if count >= MIN_CHAR_COUNT}
+        cost_bits = CONTEXT_COST_BITS + len(contexts[ctx[1:]]) - 1 + CHAR_COST_BITS * len(kept)
+        if not kept or sum(ctx_counts.values()) < MIN_CONTEXT_COUNT or \
+                _gain_bits(ctx_counts, counts[ctx[1:]]) < cost_bits:
+            continue
+        contexts[ctx] = _quantized(kept, max(sum(ctx_counts.values()) - sum(kept.values()), 1), MIN_CHAR_COUNT)
+    return SemiStaticModel(contexts)
+
+
+# bits the context saves over its parent (with full counts on both sides)
+def _gain_bits(ctx_counts, parent_counts):
+    total = sum(ctx_counts.values())
+    parent_total = sum(parent_counts.values())
+    return sum(count * math.log2(count / total * parent_total / parent_counts[c]) for c, count in ctx_counts.items())
+
+
+# Only the ratios within a context matter, so counts above what a byte holds are scaled down together
+# (otherwise every frequent char of a big context would quantize to the same 255)
+def _quantized(char_counts, escape_count, min_count):
+    kept = {c: char_counts[c] for c in sorted(char_counts) if char_counts[c] >= min_count}
+    scale = min(1, dequantize(MAX_QUANTIZED) / max([escape_count] + list(kept.values())))
+    res = {LeftContext.UP: quantize(max(escape_count * scale, 1))}
+    for c, count in kept.items():
+        res[c] = quantize(max(count * scale, 1))
+    return res
+
+
+# Fills the tree with the model and stops it from learning; the same tree is built on both sides
+def load_semi_static_model(tree: LeftContextTree, model: SemiStaticModel):
+    for ctx in sorted(model.contexts, key=len):
+        node = tree._extend_down(ctx)
+        counts = model.contexts[ctx]
+        node.chars_to_indices = {c: i for i, c in enumerate(counts)}
+        node.indices_to_chars = {i: c for i, c in enumerate(counts)}
+        node.distribution = ExtendableFenwickTree(len(counts))
+        node.distribution.inner.init([dequantize(q) for q in counts.values()])
+    tree.frozen = True
+    tree.see = None  # escape frequencies come from the model
+
+
+_worker_decoder = None
+
+
+def _init_worker(coding_params: CodingParams, model: SemiStaticModel):
+    global _worker_decoder
+    _worker_decoder = StatisticDecoder(None, 0, coding_params)
+    load_semi_static_model(_worker_decoder.left_ctx_tree, model)
+
+
+def _decode_worker_segment(segment: SegmentHeader, data: bytes) -> str:
+    return ''.join(decode_segment(_worker_decoder, segment, data))
+
+
+# Segments of a semi-static stream over a process pool; every worker builds the tree once.
+# Frames are read as workers take them, at most IN_FLIGHT_PER_WORKER per worker are read ahead and not yet yielded
+def decode_segments_parallel(input_f, length, coding_params: CodingParams, model: SemiStaticModel,
+                             jobs: Optional[int] = None) -> Iterable[str]:
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(coding_params, model)) as executor:
+        in_flight = collections.deque()
+        for segment, data in iter_segment_frames(input_f, length):
+            if len(in_flight) >= IN_FLIGHT_PER_WORKER * workers:
+                yield from in_flight.popleft().result()
+            in_flight.append(executor.submit(_decode_worker_segment, segment, data))
+        while in_flight:
+            yield from in_flight.popleft().result()
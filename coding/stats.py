@@ -0,0 +1,157 @@
+import math
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Callable, List
+
+
+# Counters are only touched by the instrumented encode/decode loops (see StatisticEncoder/StatisticDecoder),
+# the plain loops don't know this class exists
+@dataclass
+class CodingStats:
+    on_progress: Optional[Callable[['CodingStats'], None]] = None
+    progress_interval: int = 16 * 1024  # symbols between on_progress calls
+    total_length: Optional[int] = None  # for progress fraction, if known
+
+    symbols: int = 0
+    escapes_per_order: Dict[int, int] = field(default_factory=dict)
+    chars_per_order: Dict[int, int] = field(default_factory=dict)  # order the char itself was coded in
+    bits_per_order: Dict[int, float] = field(default_factory=dict)
+    escape_bits: float = 0
+    deterministic_contexts: int = 0  # symbols coded starting from a context with exactly one seen char
+    deterministic_hits: int = 0  # ...and that char was the right one
+    masked_distribution_builds: int = 0
+    match_flags: int = 0  # PredictedCharModel predictions (match model or unbounded contexts), LineFieldModel contexts
+    match_hits: int = 0
+    match_bits: float = 0
+    stored_segments: int = 0  # written as is, see coding/segments.py; their chars aren't in symbols
+    stored_chars: int = 0
+    node_count: int = 0
+    model_bytes: int = 0  # estimated, filled in by finish()
+    output_bits: int = 0
+
+    start_time: float = 0
+    elapsed_s: float = 0
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    # order -1 is the pseudo root (uniform distribution over the alphabet);
+    # steps are step_bits() of every coded char/escape, taken before the model is updated;
+    # match is None without a PredictedCharModel prediction, otherwise steps start with its flag;
+    # mixed: steps are the 8 bits of a MixingModel char, order is where PPM would've coded it, no escapes are counted
+    def record_symbol(self, order: int, deterministic: bool, steps: List[float], masked: bool,
+                      match: Optional[bool] = None, mixed: bool = False):
+        self.symbols += 1
+        if mixed:
+            self.bits_per_order[order] = self.bits_per_order.get(order, 0) + sum(steps)
+            self.chars_per_order[order] = self.chars_per_order.get(order, 0) + 1
+            self._maybe_report_progress()
+            return
+        if match is not None:
+            self.match_flags += 1
+            self.match_bits += steps[0]
+            steps = steps[1:]
+            if match:
+                self.match_hits += 1
+                self._maybe_report_progress()
+                return
+
+        last_step = len(steps) - 1
+        for i, bits in enumerate(steps):
+            step_order = order - i
+            self.bits_per_order[step_order] = self.bits_per_order.get(step_order, 0) + bits
+            if i != last_step:
+                self.escapes_per_order[step_order] = self.escapes_per_order.get(step_order, 0) + 1
+                self.escape_bits += bits
+        coded_order = order - last_step
+        self.chars_per_order[coded_order] = self.chars_per_order.get(coded_order, 0) + 1
+
+        if masked:
+            self.masked_distribution_builds += len(steps)
+        if deterministic:
+            self.deterministic_contexts += 1
+            if last_step == 0:
+                self.deterministic_hits += 1
+        self._maybe_report_progress()
+
+    def record_stored(self, length):
+        self.stored_segments += 1
+        self.stored_chars += length
+        if self.on_progress is not None:
+            self.elapsed_s = time.perf_counter() - self.start_time
+            self.on_progress(self)
+
+    def _maybe_report_progress(self):
+        if self.on_progress is not None and self.symbols % self.progress_interval == 0:
+            self.elapsed_s = time.perf_counter() - self.start_time
+            self.on_progress(self)
+
+    def finish(self, left_ctx_tree):
+        self.elapsed_s = time.perf_counter() - self.start_time
+        self.model_bytes = estimate_model_bytes(left_ctx_tree)
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def throughput(self) -> float:
+        return (self.symbols + self.stored_chars) / self.elapsed_s if self.elapsed_s > 0 else 0
+
+    def progress(self) -> Optional[float]:
+        if not self.total_length:
+            return None
+        return (self.symbols + self.stored_chars) / self.total_length
+
+    def model_bits(self) -> float:  # -log2(p) of everything coded, i.e. output_bits without the coder's losses
+        return sum(self.bits_per_order.values()) + self.match_bits
+
+    def to_dict(self):
+        model_bits = self.model_bits()
+        return {
+            'symbols': self.symbols,
+            'elapsed_s': round(self.elapsed_s, 3),
+            'throughput_chars_per_s': round(self.throughput(), 1),
+            'output_bits': self.output_bits,
+            'model_bits': round(model_bits, 1),
+            'bits_per_char': round(model_bits / self.symbols, 4) if self.symbols > 0 else 0,
+            'escapes': sum(self.escapes_per_order.values()),
+            'escapes_per_order': dict(sorted(self.escapes_per_order.items())),
+            'chars_per_order': dict(sorted(self.chars_per_order.items())),
+            'bits_per_order': {order: round(bits, 1) for order, bits in sorted(self.bits_per_order.items())},
+            'escape_bits': round(self.escape_bits, 1),
+            'deterministic_contexts': self.deterministic_contexts,
+            'deterministic_hit_rate': round(self.deterministic_hits / self.deterministic_contexts, 4)
+            if self.deterministic_contexts > 0 else None,
+            'masked_distribution_builds': self.masked_distribution_builds,
+            'match_flags': self.match_flags,
+            'match_hit_rate': round(self.match_hits / self.match_flags, 4) if self.match_flags > 0 else None,
+            'match_bits': round(self.match_bits, 1),
+            'stored_segments': self.stored_segments,
+            'stored_chars': self.stored_chars,
+            'node_count': self.node_count,
+            'model_bytes': self.model_bytes,
+        }
+
+
+def step_bits(distribution, char_idx) -> float:
+    return -math.log2(distribution[char_idx] / distribution.prefix_sum(len(distribution)))
+
+
+def estimate_model_bytes(left_ctx_tree) -> int:
+    if hasattr(left_ctx_tree, 'table_bytes'):  # HashedContextTable, preallocated
+        return left_ctx_tree.table_bytes()
+    if left_ctx_tree.root is None:
+        return 0
+
+    total = 0
+    stack = [left_ctx_tree.root]
+    while stack:
+        ctx = stack.pop()
+        total += sys.getsizeof(ctx) + sys.getsizeof(ctx.__dict__) + sys.getsizeof(ctx.s)
+        total += sys.getsizeof(ctx.chars_to_indices) + sys.getsizeof(ctx.indices_to_chars)
+        total += sys.getsizeof(ctx.distribution) + sys.getsizeof(ctx.distribution.inner._v)
+        if ctx.seen_once_chars is not None:
+            total += sys.getsizeof(ctx.seen_once_chars)
+        if ctx._children is not None:
+            total += sys.getsizeof(ctx._children)
+            stack.extend(ctx._children.values())
+    return total
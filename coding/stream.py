@@ -0,0 +1,176 @@
+import io
+import math
+from dataclasses import dataclass
+from typing import Optional, Iterable, Callable
+from coding.codec import StatisticEncoder, StatisticDecoder, StatisticEstimator
+from coding.coding_params import CodingParams
+from coding.stats import CodingStats
+from coding.capitalization import get_cap_data, capitalize_iter, decapitalize_iter, CapitalizationData
+from coding.deadline import DeadlinePacer
+from coding.segments import encode_segments, decode_segments, estimate_segments
+from coding.semi_static import SemiStaticModel, build_semi_static_model, load_semi_static_model, \
+    decode_segments_parallel
+from coding.word_dictionary import build_word_dictionary, encode_words_iter, decode_words_iter, WordDictionary
+from headers.header import Header
+from headers.capitalization_header import CapitalizationHeader
+from headers.word_dictionary_header import WordDictionaryHeader
+from headers.semi_static_header import SemiStaticHeader
+from headers.checksum_trailer import ChecksumTrailer, ChecksumError
+from utils.iter_utils import iter_bits, write_bits, TailHoldingReader
+from utils.checksum import Crc32
+
+
+# everything before the coded bits
+@dataclass
+class StreamHeaders:
+    header: Header
+    cap_data: Optional[CapitalizationData] = None
+    dictionary: Optional[WordDictionary] = None
+    model: Optional[SemiStaticModel] = None
+
+    def coded_length(self):  # chars that actually go through the model
+        return self.dictionary.coded_length if self.dictionary is not None else self.header.length
+
+    def write(self, dest_f):
+        dest_f.write(self.header.serialize())
+        if self.cap_data is not None:
+            dest_f.write(CapitalizationHeader(self.cap_data).serialize())
+        if self.dictionary is not None:
+            dest_f.write(WordDictionaryHeader(self.dictionary).serialize())
+        if self.model is not None:
+            dest_f.write(SemiStaticHeader(self.model).serialize())
+
+    @staticmethod
+    def read(input_f):
+        headers = StreamHeaders(Header.deserialize(input_f.read(Header.header_length())))
+        if headers.header.coding_params.decapitalize:
+            headers.cap_data = CapitalizationHeader.deserialize(input_f).cap_data
+        if headers.header.coding_params.word_dictionary:
+            headers.dictionary = WordDictionaryHeader.deserialize(input_f).dictionary
+        if headers.header.coding_params.semi_static:
+            headers.model = SemiStaticHeader.deserialize(input_f).model
+        return headers
+
+    def is_segmented(self):
+        coding_params = self.header.coding_params
+        return coding_params.stored_segments or coding_params.semi_static or coding_params.segmented
+
+
+# One coded stream: header, capitalization header (if any), word dictionary (if any), semi-static model (if any),
+# coded bits, checksum trailer. iter_source is called once per pass over the text (one more for each of
+# decapitalization, word dictionary and semi-static model).
+# pacer (deadline mode) needs a segmented stream, it changes the model between segments
+def encode_stream(iter_source: Callable[[], Iterable[str]], length, dest_f, coding_params: CodingParams,
+                  stats: Optional[CodingStats] = None, pacer: Optional[DeadlinePacer] = None):
+    headers = build_headers(iter_source, length, coding_params)
+    headers.write(dest_f)
+
+    checksum = Crc32()
+    encode_bits(decapitalized_source(checksum.update_iter(iter_source()), coding_params), headers, dest_f, stats,
+                pacer)
+    dest_f.write(ChecksumTrailer(checksum.value).serialize())
+
+
+# takes a pass over the text for each of decapitalization, word dictionary and semi-static model
+def build_headers(iter_source: Callable[[], Iterable[str]], length, coding_params: CodingParams) -> StreamHeaders:
+    headers = StreamHeaders(Header(length, coding_params))
+    if coding_params.decapitalize:
+        headers.cap_data = get_cap_data(iter_source())
+    if coding_params.word_dictionary:
+        headers.dictionary = build_word_dictionary(decapitalized_source(iter_source(), coding_params))
+    if coding_params.semi_static:
+        headers.model = build_semi_static_model(model_source(iter_source(), headers), coding_params)
+    return headers
+
+
+# Archive size encode_stream would produce, without running the bit coder or writing anything:
+# headers are serialized for real, coded bits are the sum of -log2(p) (per order, in stats)
+def estimate_stream(iter_source: Callable[[], Iterable[str]], length, coding_params: CodingParams,
+                    stats: CodingStats) -> int:
+    headers = build_headers(iter_source, length, coding_params)
+    headers_f = io.BytesIO()
+    headers.write(headers_f)
+
+    iter_char = model_source(iter_source(), headers)
+    stats.total_length = headers.coded_length()
+    estimator = StatisticEstimator(iter_char, coding_params, stats)
+    if headers.model is not None:
+        load_semi_static_model(estimator.left_ctx_tree, headers.model)
+    if headers.is_segmented():
+        coded_bytes = estimate_segments(estimator, iter_char)
+    else:
+        coded_bytes = math.ceil(estimator.estimate() / 8)
+    return len(headers_f.getvalue()) + coded_bytes + ChecksumTrailer.trailer_length()
+
+
+def decapitalized_source(iter_char: Iterable[str], coding_params: CodingParams) -> Iterable[str]:
+    return decapitalize_iter(iter_char) if coding_params.decapitalize else iter_char
+
+
+# the text as the model sees it: decapitalized and with dictionary words replaced, if those are on
+def model_source(iter_char: Iterable[str], headers: StreamHeaders) -> Iterable[str]:
+    iter_char = decapitalized_source(iter_char, headers.header.coding_params)
+    if headers.dictionary is not None:
+        iter_char = encode_words_iter(iter_char, headers.dictionary)
+    return iter_char
+
+
+# iter_char is already decapitalized if needed
+def encode_bits(iter_char: Iterable[str], headers: StreamHeaders, dest_f, stats: Optional[CodingStats] = None,
+                pacer: Optional[DeadlinePacer] = None):
+    if headers.dictionary is not None:
+        iter_char = encode_words_iter(iter_char, headers.dictionary)
+    if stats is not None:
+        stats.total_length = headers.coded_length()
+    encoder = StatisticEncoder(iter_char, headers.header.coding_params, stats)
+    if headers.model is not None:
+        load_semi_static_model(encoder.left_ctx_tree, headers.model)
+    if headers.is_segmented():
+        if pacer is not None:
+            pacer.start(headers.coded_length())
+        encode_segments(encoder, iter_char, dest_f, pacer)
+    else:
+        if pacer is not None:
+            raise Exception('Deadline mode needs a segmented stream (segmented, stored_segments or semi_static)')
+        write_bits(encoder.encode(), dest_f)
+
+
+# checks the trailer once the text is over, so consumers see ChecksumError only after the last char.
+# jobs is for semi-static streams only, their segments are decoded in that many processes (unless stats are asked for)
+def decode_stream(input_f, stats: Optional[CodingStats] = None, jobs: Optional[int] = 1) -> Iterable[str]:
+    input_f = TailHoldingReader(input_f, ChecksumTrailer.trailer_length())
+    headers = StreamHeaders.read(input_f)
+
+    iter_char = decode_chars(input_f, headers, stats, jobs)
+    if headers.cap_data is not None:
+        iter_char = capitalize_iter(iter_char, headers.cap_data)
+    checksum = Crc32()
+    yield from checksum.update_iter(iter_char)
+    check_trailer(input_f, checksum)
+
+
+# still decapitalized, if it was
+def decode_chars(input_f, headers: StreamHeaders, stats: Optional[CodingStats] = None,
+                 jobs: Optional[int] = 1) -> Iterable[str]:
+    if stats is not None:
+        stats.total_length = headers.coded_length()
+    coding_params = headers.header.coding_params
+    if headers.model is not None and stats is None and jobs != 1:
+        iter_char = decode_segments_parallel(input_f, headers.coded_length(), coding_params, headers.model, jobs)
+    elif headers.is_segmented():
+        decoder = StatisticDecoder(None, headers.coded_length(), coding_params, stats)
+        if headers.model is not None:
+            load_semi_static_model(decoder.left_ctx_tree, headers.model)
+        iter_char = decode_segments(decoder, input_f, headers.coded_length())
+    else:
+        decoder = StatisticDecoder(iter_bits(input_f), headers.coded_length(), headers.header.coding_params, stats)
+        iter_char = decoder.decode()
+    if headers.dictionary is not None:
+        iter_char = decode_words_iter(iter_char, headers.dictionary)
+    return iter_char
+
+
+def check_trailer(input_f: TailHoldingReader, checksum: Crc32):
+    trailer = ChecksumTrailer.deserialize(input_f.tail())
+    if trailer.crc32 != checksum.value:
+        raise ChecksumError(f'Checksum mismatch: stored {trailer.crc32:08x}, decoded {checksum.value:08x}')
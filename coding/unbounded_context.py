@@ -0,0 +1,85 @@
+from typing import Optional, List
+
+from coding.match_model import PredictedCharModel, FLAG_BUCKETS
+
+MAX_AUTOMATON_STATES = 1 << 19  # ~260 bytes each; then the automaton is rebuilt from the last REBUILD_KEEP chars
+REBUILD_KEEP = 64 * 1024
+
+
+# Online suffix automaton over everything coded so far, amortized O(1) per char whatever the context length.
+# A state is a class of substrings with the same set of end positions, so its transitions are exactly
+# the chars that have followed those substrings
+class SuffixAutomaton:
+    def __init__(self):
+        self.length = [0]  # longest substring of the state
+        self.link = [-1]  # state of the longest suffix with more end positions
+        self.next = [{}]
+        self.last = 0  # state of the whole history
+
+    def extend(self, c):
+        cur = len(self.length)
+        self.length.append(self.length[self.last] + 1)
+        self.link.append(0)
+        self.next.append({})
+
+        p = self.last
+        while p != -1 and c not in self.next[p]:
+            self.next[p][c] = cur
+            p = self.link[p]
+
+        if p != -1:
+            q = self.next[p][c]
+            if self.length[p] + 1 == self.length[q]:
+                self.link[cur] = q
+            else:
+                clone = len(self.length)
+                self.length.append(self.length[p] + 1)
+                self.link.append(self.link[q])
+                self.next.append(dict(self.next[q]))
+                while p != -1 and self.next[p].get(c) == q:
+                    self.next[p][c] = clone
+                    p = self.link[p]
+                self.link[q] = clone
+                self.link[cur] = clone
+
+        self.last = cur
+
+    # state of the longest suffix of the history that also occurred earlier, 0 (empty context) if none
+    def longest_seen_suffix(self):
+        return max(self.link[self.last], 0)
+
+
+# PPM*-style unbounded contexts on top of the bounded LeftContextTree: if every earlier occurrence of the
+# longest previously seen context was followed by the same char, that char is predicted.
+# Determinism only gets stronger for longer contexts, so the shortest deterministic context (if there is one)
+# predicts the same char as the longest one - there's no need to walk the suffix links looking for it.
+# Contexts not longer than context_length are left to the tree, which already knows them.
+# Otherwise (nothing deterministic) the char goes to the tree's longest context of at most context_length.
+# The automaton has up to two states per char, so it only covers the text since it was last rebuilt
+class UnboundedContextModel(PredictedCharModel):
+    def __init__(self, left_ctx_tree, context_length):
+        super().__init__(left_ctx_tree)
+        self.context_length = context_length
+        self.automaton = SuffixAutomaton()
+        self.history: List[str] = []  # what the automaton was built from
+        self.state = 0
+
+    def _predicted(self) -> Optional[str]:
+        transitions = self.automaton.next[self.state]
+        if self.automaton.length[self.state] <= self.context_length or len(transitions) != 1:
+            return None
+        return next(iter(transitions))
+
+    # by the length of the deterministic context
+    def _flag_bucket(self):
+        return min((self.automaton.length[self.state] - self.context_length).bit_length(), FLAG_BUCKETS - 1)
+
+    def _update_history(self, c):
+        self.history.append(c)
+        self.automaton.extend(c)
+        if len(self.automaton.length) >= MAX_AUTOMATON_STATES:
+            self.history = self.history[-REBUILD_KEEP:]
+            self.automaton = SuffixAutomaton()
+            for h in self.history:
+                self.automaton.extend(h)
+        self.state = self.automaton.longest_seen_suffix()
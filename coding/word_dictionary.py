@@ -0,0 +1,88 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+
+MIN_WORD_COUNT = 2
+HEADER_CHAR_COST = 8  # in saved text chars: a header char is raw 8 bits, a saved text char is ~1 bit after PPM
+
+
+# Frequent whole words (maximal runs of ascii letters) are replaced by a single char that never occurs in the text,
+# so the inverse transform only has to look codes up. A text that uses all 256 chars gets an empty dictionary
+@dataclass
+class WordDictionary:
+    words: Dict[str, str]  # code -> word
+    coded_length: int  # length of the transformed text, that's what the decoder decodes
+
+    def codes(self) -> Dict[str, str]:  # word -> code
+        return {word: code for code, word in self.words.items()}
+
+
+def _is_letter(c):
+    return c.isalpha() and c.isascii()
+
+
+def build_word_dictionary(iter_text: Iterable[str]) -> WordDictionary:
+    length = 0
+    seen_chars = set()
+    word_counts: Dict[str, int] = {}
+    word = []
+    for c in iter_text:
+        length += 1
+        seen_chars.add(c)
+        if _is_letter(c):
+            word.append(c)
+        elif word:
+            _count_word(word_counts, word)
+    if word:
+        _count_word(word_counts, word)
+
+    # no capitals: they are missing from the tree's alphabet after decapitalization
+    free_codes = [chr(i) for i in range(256) if chr(i) not in seen_chars and not chr(i).isupper()]
+
+    # a word saves len - 1 chars per occurrence and costs itself + code + terminator in the header
+    gains = [(count * (len(word) - 1) - HEADER_CHAR_COST * (len(word) + 2), word) for word, count in word_counts.items()
+             if count >= MIN_WORD_COUNT]
+    chosen: List[str] = [word for gain, word in sorted(gains, reverse=True) if gain > 0][:len(free_codes)]
+
+    coded_length = length - sum(word_counts[word] * (len(word) - 1) for word in chosen)
+    return WordDictionary(dict(zip(free_codes, chosen)), coded_length)
+
+
+def _count_word(word_counts, word: List[str]):
+    s = ''.join(word)
+    word_counts[s] = word_counts.get(s, 0) + 1
+    word.clear()
+
+
+def encode_words_iter(iter_text: Iterable[str], dictionary: WordDictionary) -> Iterable[str]:
+    codes = dictionary.codes()
+    word = []
+    for c in iter_text:
+        if _is_letter(c):
+            word.append(c)
+            continue
+        if word:
+            yield from _encode_word(word, codes)
+        yield c
+    if word:
+        yield from _encode_word(word, codes)
+
+
+def _encode_word(word: List[str], codes) -> Iterable[str]:
+    s = ''.join(word)
+    word.clear()
+    code = codes.get(s)
+    if code is not None:
+        yield code
+    else:
+        yield from s
+
+
+# char by char, capitalize_iter wants single chars
+def decode_words_iter(iter_chars: Iterable[str], dictionary: WordDictionary) -> Iterable[str]:
+    words = dictionary.words
+    for c in iter_chars:
+        word = words.get(c)
+        if word is not None:
+            yield from word
+        else:
+            yield c
@@ -0,0 +1,171 @@
+import io
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque
+from coding.coding_params import CodingParams
+from coding.stream import encode_stream, decode_stream
+from headers.daemon_protocol import DaemonOp, DaemonRequest, DaemonResponse
+from utils.iter_utils import iter_buffer_chars
+
+# Long-running coder behind a unix socket: interpreter startup and imports are paid once per worker process,
+# not once per file, which is most of the latency for small payloads. See daemon_client.py for the other side.
+# A connection may send any number of requests, one after another
+
+DEFAULT_SOCKET = '/tmp/ppm-coder.sock'
+MAX_PAYLOAD = 256 * 1024 * 1024  # payloads are held in memory on both sides
+LATENCY_WINDOW = 1024  # last requests that latency percentiles are taken over
+WARM_UP_TEXT = b'Warm up, warm up! Imports and code paths, so that the first real request is not the slow one.\n'
+
+
+@dataclass
+class DaemonStats:
+    workers: int
+    queue_depth: int = 0  # requests handed to the pool that haven't finished yet
+    max_queue_depth: int = 0
+    served: int = 0
+    failed: int = 0
+    latencies_ms: Deque[float] = field(default_factory=lambda: collections.deque(maxlen=LATENCY_WINDOW))
+
+    def to_dict(self):
+        latencies = sorted(self.latencies_ms)
+        return {
+            'workers': self.workers,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'served': self.served,
+            'failed': self.failed,
+            'latency_ms_p50': round(latencies[len(latencies) // 2], 1) if latencies else None,
+            'latency_ms_p99': round(latencies[int(len(latencies) * 0.99)], 1) if latencies else None,
+            'latency_ms_max': round(latencies[-1], 1) if latencies else None,
+        }
+
+
+class CodingDaemon:
+    def __init__(self, socket_path=DEFAULT_SOCKET, workers=None, log=sys.stderr):
+        self.socket_path = socket_path
+        self.workers = workers or os.cpu_count()
+        self.log = log
+        self.stats = DaemonStats(self.workers)
+        self.pool = None
+
+    async def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)  # left by a daemon that was killed
+
+        with ProcessPoolExecutor(max_workers=self.workers) as self.pool:
+            await self._warm_up()
+            server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+            print(f'Listening on {self.socket_path} with {self.workers} workers', file=self.log)
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, asyncio.current_task().cancel)
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+
+    # the pool is started and has been through the coder's code paths before the first request comes
+    async def _warm_up(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers)])
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request_bytes = await reader.readexactly(DaemonRequest.request_length())
+                except asyncio.IncompleteReadError as e:
+                    if len(e.partial) > 0:
+                        print('Connection closed in the middle of a request', file=self.log)
+                    return
+                try:
+                    request = DaemonRequest.deserialize(request_bytes)
+                except ValueError as e:
+                    await self._respond(writer, False, f'Bad request: {e}'.encode('utf-8'))
+                    return
+                if not await self._handle_request(request, reader, writer):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f'Connection lost: {e.__class__.__name__}: {e}', file=self.log)
+        finally:
+            writer.close()
+
+    # False if the connection can't go on
+    async def _handle_request(self, request: DaemonRequest, reader, writer) -> bool:
+        t0 = time.perf_counter()
+        if request.header.length > MAX_PAYLOAD:
+            await self._respond(writer, False, f'Payload is longer than {MAX_PAYLOAD} bytes'.encode('utf-8'))
+            return False  # the payload is still in the socket
+        payload = await reader.readexactly(request.header.length)
+
+        if request.op == DaemonOp.STATUS:
+            await self._respond(writer, True, json.dumps(self.stats.to_dict()).encode('utf-8'))
+            return True
+
+        queue_depth = self._enter_queue()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.pool, _code, request.op, payload, request.header.coding_params)
+            ok = True
+        except Exception as e:
+            result = f'{e.__class__.__name__}: {e}'.encode('utf-8')
+            ok = False
+        finally:
+            self.stats.queue_depth -= 1
+        await self._respond(writer, ok, result)
+
+        latency_ms = (time.perf_counter() - t0) * 1000
+        self.stats.latencies_ms.append(latency_ms)
+        if ok:
+            self.stats.served += 1
+        else:
+            self.stats.failed += 1
+        print(f'{request.op.name:5} {"OK    " if ok else "FAILED"} {len(payload)} -> {len(result)} bytes, '
+              f'queue depth {queue_depth}, {latency_ms:.1f} ms', file=self.log)
+        return True
+
+    def _enter_queue(self):
+        self.stats.queue_depth += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+        return self.stats.queue_depth
+
+    @staticmethod
+    async def _respond(writer, ok, payload: bytes):
+        writer.write(DaemonResponse(ok, len(payload)).serialize())
+        writer.write(payload)
+        await writer.drain()
+
+
+# runs in the worker processes
+
+def _code(op: DaemonOp, payload: bytes, coding_params: CodingParams) -> bytes:
+    if op == DaemonOp.ZIP:
+        dest_f = io.BytesIO()
+        encode_stream(lambda: iter_buffer_chars(payload), len(payload), dest_f, coding_params)
+        return dest_f.getvalue()
+    if op == DaemonOp.UNZIP:
+        return ''.join(decode_stream(io.BytesIO(payload))).encode('iso-8859-1')
+    raise Exception(f'Unknown op {op}')
+
+
+def _warm_up():
+    archive = _code(DaemonOp.ZIP, WARM_UP_TEXT, CodingParams())
+    if _code(DaemonOp.UNZIP, archive, CodingParams()) != WARM_UP_TEXT:
+        raise Exception('Warm up roundtrip failed')
+
+
+# until SIGTERM/SIGINT
+def serve(socket_path=DEFAULT_SOCKET, workers=None):
+    try:
+        asyncio.run(CodingDaemon(socket_path, workers).serve_forever())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,77 @@
+import sys
+import json
+import socket
+import argparse
+from coding.coding_params import CodingParams
+from headers.header import Header
+from headers.daemon_protocol import DaemonOp, DaemonRequest, DaemonResponse
+from utils.cli_args import add_coding_params_args, coding_params_from_args
+
+# Thin client for daemon.py: imports neither the coder nor its dependencies, so its own startup stays short
+DEFAULT_SOCKET = '/tmp/ppm-coder.sock'  # same as daemon.DEFAULT_SOCKET
+
+
+def request(op: DaemonOp, payload: bytes = b'', coding_params: CodingParams = CodingParams(),
+            socket_path=DEFAULT_SOCKET) -> bytes:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(DaemonRequest(op, Header(len(payload), coding_params)).serialize())
+        s.sendall(payload)
+
+        response = DaemonResponse.deserialize(_recv_exactly(s, DaemonResponse.response_length()))
+        result = _recv_exactly(s, response.length)
+    if not response.ok:
+        raise Exception(f'Daemon: {result.decode("utf-8")}')
+    return result
+
+
+def _recv_exactly(s, n) -> bytes:
+    chunks = []
+    while n > 0:
+        chunk = s.recv(min(n, 1024 * 1024))
+        if not chunk:
+            raise Exception('Daemon closed the connection')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _read_input(filename) -> bytes:
+    if filename == '-':
+        return sys.stdin.buffer.read()
+    with open(filename, mode='rb') as f:
+        return f.read()
+
+
+def _write_output(filename, data: bytes):
+    if filename == '-':
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+        return
+    with open(filename, mode='wb') as f:
+        f.write(data)
+
+
+def console_app():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', type=str, choices=['zip', 'unzip', 'status'])
+    parser.add_argument('source_file', type=str, nargs='?', help='not needed for status')
+    parser.add_argument('dest_file', type=str, nargs='?', help='not needed for status')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET)
+    add_coding_params_args(parser)
+    args = parser.parse_args()
+
+    try:
+        if args.mode == 'status':
+            print(json.dumps(json.loads(request(DaemonOp.STATUS, socket_path=args.socket)), indent=2))
+            return
+        op = DaemonOp.ZIP if args.mode == 'zip' else DaemonOp.UNZIP
+        result = request(op, _read_input(args.source_file), coding_params_from_args(args), args.socket)
+        _write_output(args.dest_file, result)
+    except Exception as e:
+        print(f'{e.__class__.__name__}: {e}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    console_app()
@@ -0,0 +1,27 @@
+import struct
+from dataclasses import dataclass
+
+
+class ChecksumError(Exception):
+    pass
+
+
+# goes after the coded bits, so that the encoder doesn't have to know the checksum before it starts writing
+@dataclass
+class ChecksumTrailer:
+    # little-endian 4b us, crc32 of the original text (iso-8859-1 bytes)
+    STRUCT_FMT = '< I'
+
+    crc32: int
+
+    @staticmethod
+    def trailer_length():
+        return struct.calcsize(ChecksumTrailer.STRUCT_FMT)
+
+    def serialize(self):
+        return struct.pack(ChecksumTrailer.STRUCT_FMT, self.crc32)
+
+    @staticmethod
+    def deserialize(bytes):
+        (crc32,) = struct.unpack(ChecksumTrailer.STRUCT_FMT, bytes)
+        return ChecksumTrailer(crc32)
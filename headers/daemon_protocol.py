@@ -0,0 +1,55 @@
+import struct
+from dataclasses import dataclass
+from enum import Enum
+from headers.header import Header
+
+
+class DaemonOp(Enum):
+    ZIP = 1
+    UNZIP = 2
+    STATUS = 3  # payload-less, answers with daemon stats as JSON
+
+
+# followed by header.length payload bytes: text for ZIP, archive for UNZIP
+@dataclass
+class DaemonRequest:
+    # little-endian 1b us: op, then a Header whose length is the payload length (coding params matter only for ZIP)
+    OP_FMT = '< B'
+
+    op: DaemonOp
+    header: Header
+
+    @staticmethod
+    def request_length():
+        return struct.calcsize(DaemonRequest.OP_FMT) + Header.header_length()
+
+    def serialize(self):
+        return struct.pack(DaemonRequest.OP_FMT, self.op.value) + self.header.serialize()
+
+    @staticmethod
+    def deserialize(bytes):
+        op_length = struct.calcsize(DaemonRequest.OP_FMT)
+        (op,) = struct.unpack(DaemonRequest.OP_FMT, bytes[:op_length])
+        return DaemonRequest(DaemonOp(op), Header.deserialize(bytes[op_length:]))
+
+
+# followed by length payload bytes: the result, or a utf-8 error message if not ok
+@dataclass
+class DaemonResponse:
+    # little-endian 1b us, 8b us
+    STRUCT_FMT = '< B Q'
+
+    ok: bool
+    length: int
+
+    @staticmethod
+    def response_length():
+        return struct.calcsize(DaemonResponse.STRUCT_FMT)
+
+    def serialize(self):
+        return struct.pack(DaemonResponse.STRUCT_FMT, self.ok, self.length)
+
+    @staticmethod
+    def deserialize(bytes):
+        (ok, length) = struct.unpack(DaemonResponse.STRUCT_FMT, bytes)
+        return DaemonResponse(ok > 0, length)
@@ -0,0 +1,76 @@
+import struct
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass
+class ArchiveEntry:
+    name: str  # '/'-separated, relative to the packed directory
+    group: int
+    offset: int  # in the text of the group
+    length: int
+    crc32: int
+
+
+@dataclass
+class SolidGroup:
+    offset: int  # of the group stream, from the start of the archive
+    length: int  # of the group stream
+
+
+# Multi-file archive: MAGIC, group streams (each one is a usual single-file stream), entry table, footer.
+# The footer points at the table, so listing only needs two seeks
+@dataclass
+class EntryTable:
+    MAGIC = b'PPMSOLID'  # can't be confused with a single-file stream, that starts with Header.MAGIC
+    # little-endian 8b us, 8b us
+    LENGTHS_FMT = '< Q Q'
+    # little-endian 8b us, 8b us
+    GROUP_FMT = '< Q Q'
+    # little-endian 2b us (utf-8 name length), 8b us, 8b us, 8b us, 4b us
+    ENTRY_FMT = '< H Q Q Q I'
+    # little-endian 8b us, table offset
+    FOOTER_FMT = '< Q'
+
+    groups: List[SolidGroup]
+    entries: List[ArchiveEntry]
+
+    @staticmethod
+    def footer_length():
+        return struct.calcsize(EntryTable.FOOTER_FMT)
+
+    def serialize(self) -> bytes:
+        serialized = [struct.pack(EntryTable.LENGTHS_FMT, len(self.groups), len(self.entries))]
+        for group in self.groups:
+            serialized.append(struct.pack(EntryTable.GROUP_FMT, group.offset, group.length))
+        for entry in self.entries:
+            name_bytes = entry.name.encode('utf-8')
+            serialized.append(struct.pack(EntryTable.ENTRY_FMT, len(name_bytes), entry.group, entry.offset,
+                                          entry.length, entry.crc32))
+            serialized.append(name_bytes)
+        return b''.join(serialized)
+
+    @staticmethod
+    def serialize_footer(table_offset) -> bytes:
+        return struct.pack(EntryTable.FOOTER_FMT, table_offset)
+
+    @staticmethod
+    def deserialize(f):
+        groups_len, entries_len = EntryTable._read_struct(EntryTable.LENGTHS_FMT, f)
+        groups = [SolidGroup(*EntryTable._read_struct(EntryTable.GROUP_FMT, f)) for _ in range(groups_len)]
+        entries = []
+        for _ in range(entries_len):
+            name_len, group, offset, length, crc32 = EntryTable._read_struct(EntryTable.ENTRY_FMT, f)
+            entries.append(ArchiveEntry(f.read(name_len).decode('utf-8'), group, offset, length, crc32))
+        return EntryTable(groups, entries)
+
+    @staticmethod
+    def read_from_archive(f):
+        f.seek(-EntryTable.footer_length(), 2)
+        (table_offset,) = EntryTable._read_struct(EntryTable.FOOTER_FMT, f)
+        f.seek(table_offset)
+        return EntryTable.deserialize(f)
+
+    @staticmethod
+    def _read_struct(fmt, f):
+        return struct.unpack(fmt, f.read(struct.calcsize(fmt)))
@@ -2,10 +2,18 @@ import struct
 from dataclasses import dataclass
 from coding.coding_params import CodingParams, UpCharCodingAlrorithm
 
+
+# a ValueError, so that the daemon answers a bad request header with an error instead of dropping the connection
+class HeaderError(ValueError):
+    pass
+
+
 @dataclass
 class Header:
-    # little-endian 8b us, 1b us, 1b us, 1b us, 1b us, 1b us
-    STRUCT_FMT = '< Q B B B B B'
+    MAGIC = b'PM'  # first bytes of every stream
+    VERSION = 1  # of the stream format, bumped when older decoders can't read it
+    # little-endian 2b magic, 1b us version, 8b us, then 15 x 1b us
+    STRUCT_FMT = '< 2s B Q B B B B B B B B B B B B B B B'
 
     length: int
     coding_params: CodingParams
@@ -17,17 +25,39 @@ class Header:
     def serialize(self):
         return struct.pack(
             Header.STRUCT_FMT,
+            Header.MAGIC,
+            Header.VERSION,
             self.length,
             self.coding_params.context_length,
             self.coding_params.mask_seen,
             self.coding_params.exclude_on_update,
             self.coding_params.up_char_coding.value,
-            self.coding_params.decapitalize)
+            self.coding_params.decapitalize,
+            self.coding_params.inherit_counts,
+            self.coding_params.match_length,
+            self.coding_params.word_dictionary,
+            self.coding_params.unbounded_order,
+            self.coding_params.stored_segments,
+            self.coding_params.semi_static,
+            self.coding_params.line_contexts,
+            self.coding_params.hash_bits,
+            self.coding_params.mixing,
+            self.coding_params.segmented)
 
     @staticmethod
     def deserialize(bytes):
-        (length, ctx_len, mask, exclude, up_char_coding, decapitalize) = struct.unpack(Header.STRUCT_FMT, bytes)
+        (magic, version, length, ctx_len, mask, exclude, up_char_coding, decapitalize, inherit_counts, match_length,
+         word_dictionary, unbounded_order, stored_segments, semi_static, line_contexts, hash_bits,
+         mixing, segmented) = \
+            struct.unpack(Header.STRUCT_FMT, bytes)
+        if magic != Header.MAGIC:
+            raise HeaderError('Not an archive: no stream header')
+        if version != Header.VERSION:
+            raise HeaderError(f'Archive format version {version} is not supported, only {Header.VERSION}')
         return Header(length,
-                      CodingParams(ctx_len, mask > 0, exclude > 0, UpCharCodingAlrorithm(up_char_coding), decapitalize)
+                      CodingParams(ctx_len, mask > 0, exclude > 0, UpCharCodingAlrorithm(up_char_coding), decapitalize,
+                                   inherit_counts > 0, match_length, word_dictionary > 0,
+                                   unbounded_order > 0, stored_segments > 0, semi_static > 0, line_contexts > 0,
+                                   hash_bits, mixing > 0, segmented > 0)
                       )
 
@@ -0,0 +1,36 @@
+import struct
+from dataclasses import dataclass
+from enum import Enum
+
+
+class SegmentKind(Enum):
+    CODED = 1  # bits of StatisticEncoder.encode_segment
+    STORED = 2  # the chars themselves, iso-8859-1
+    END = 3  # no data, closes a message stream (see coding/messages.py)
+    STORED_LEARNED = 4  # the chars themselves, but the model has learned them: coded, they came out longer
+
+
+# in front of every segment of a segmented stream (stored_segments, semi_static or segmented), see coding/segments.py
+@dataclass
+class SegmentHeader:
+    # little-endian 1b us, 4b us, 4b us, 1b us, 1b us
+    STRUCT_FMT = '< B I I B B'
+
+    kind: SegmentKind
+    length: int  # chars
+    coded_length: int  # bytes that follow the header
+    order: int  # max context order the segment is coded with, lowered by deadline mode (see coding/deadline.py)
+    mask_seen: bool
+
+    @staticmethod
+    def header_length():
+        return struct.calcsize(SegmentHeader.STRUCT_FMT)
+
+    def serialize(self):
+        return struct.pack(SegmentHeader.STRUCT_FMT, self.kind.value, self.length, self.coded_length,
+                           self.order, self.mask_seen)
+
+    @staticmethod
+    def deserialize(bytes):
+        (kind, length, coded_length, order, mask_seen) = struct.unpack(SegmentHeader.STRUCT_FMT, bytes)
+        return SegmentHeader(SegmentKind(kind), length, coded_length, order, mask_seen > 0)
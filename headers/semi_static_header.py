@@ -0,0 +1,76 @@
+import struct
+from dataclasses import dataclass
+from typing import Dict, List
+from coding.context_tree import LeftContext
+from coding.semi_static import SemiStaticModel
+
+SIGMA = 256
+
+
+# The model as a tree, depth first from the order-0 context. Chars of a context are always among the chars of its
+# parent (see build_semi_static_model), so they go as a bitmap over the parent's chars, all 256 for the root
+@dataclass
+class SemiStaticHeader:
+    # per context, little-endian: 1b us quantized escape count, the bitmap (a bit per parent char, big-endian bits),
+    # 1b us quantized count per char, 2b us child count, first char of every child; then the children themselves
+    ESCAPE_FMT = '< B'
+    CHILDREN_FMT = '< H'
+    model: SemiStaticModel
+
+    def serialize(self) -> bytes:
+        children: Dict[str, List[str]] = {}
+        for ctx in self.model.contexts:
+            if ctx != '':
+                children.setdefault(ctx[1:], []).append(ctx)
+
+        serialized = []
+        stack = [('', [chr(c) for c in range(SIGMA)])]
+        while stack:
+            ctx, parent_chars = stack.pop()
+            (_, escape), *chars = self.model.contexts[ctx].items()
+            chars = dict(chars)
+            serialized.append(struct.pack(SemiStaticHeader.ESCAPE_FMT, escape))
+            serialized.append(SemiStaticHeader._bitmap([c in chars for c in parent_chars]))
+            serialized.append(bytes(chars[c] for c in parent_chars if c in chars))
+            ctx_children = children.get(ctx, [])
+            serialized.append(struct.pack(SemiStaticHeader.CHILDREN_FMT, len(ctx_children)))
+            serialized.append(''.join(child[0] for child in ctx_children).encode('iso-8859-1'))
+            ctx_chars = [c for c in parent_chars if c in chars]
+            stack.extend((child, ctx_chars) for child in reversed(ctx_children))
+        return b''.join(serialized)
+
+    @staticmethod
+    def deserialize(f):
+        contexts = {}
+        stack = [('', [chr(c) for c in range(SIGMA)])]
+        while stack:
+            ctx, parent_chars = stack.pop()
+            (escape,) = SemiStaticHeader._read_fmt(f, SemiStaticHeader.ESCAPE_FMT)
+            bitmap = SemiStaticHeader._read(f, (len(parent_chars) + 7) // 8)
+            ctx_chars = [c for i, c in enumerate(parent_chars) if bitmap[i // 8] >> (7 - i % 8) & 1]
+            counts = {LeftContext.UP: escape}
+            counts.update(zip(ctx_chars, SemiStaticHeader._read(f, len(ctx_chars))))
+            contexts[ctx] = counts
+            (children_len,) = SemiStaticHeader._read_fmt(f, SemiStaticHeader.CHILDREN_FMT)
+            children_chars = SemiStaticHeader._read(f, children_len).decode('iso-8859-1')
+            stack.extend((c + ctx, ctx_chars) for c in reversed(children_chars))
+        return SemiStaticHeader(SemiStaticModel(contexts))
+
+    @staticmethod
+    def _bitmap(bits: List[bool]) -> bytes:
+        res = bytearray((len(bits) + 7) // 8)
+        for i, bit in enumerate(bits):
+            if bit:
+                res[i // 8] |= 0x80 >> (i % 8)
+        return bytes(res)
+
+    @staticmethod
+    def _read_fmt(f, fmt):
+        return struct.unpack(fmt, SemiStaticHeader._read(f, struct.calcsize(fmt)))
+
+    @staticmethod
+    def _read(f, n):
+        res = f.read(n)
+        if len(res) != n:
+            raise Exception('Unexpected end of semi-static model')
+        return res
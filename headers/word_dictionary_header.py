@@ -0,0 +1,39 @@
+import struct
+from dataclasses import dataclass
+from coding.word_dictionary import WordDictionary
+
+
+@dataclass
+class WordDictionaryHeader:
+    # little-endian 8b us, 2b us: coded length, word count; then code byte + zero-terminated word per word
+    LENGTHS_FMT = '< Q H'
+    dictionary: WordDictionary
+
+    def serialize(self) -> bytes:
+        serialized = [struct.pack(WordDictionaryHeader.LENGTHS_FMT,
+                                  self.dictionary.coded_length, len(self.dictionary.words))]
+        for code, word in self.dictionary.words.items():
+            serialized.append((code + word).encode('iso-8859-1') + b'\0')  # words are ascii letters only
+        return b''.join(serialized)
+
+    @staticmethod
+    def deserialize(f):
+        lengths_bytes = f.read(struct.calcsize(WordDictionaryHeader.LENGTHS_FMT))
+        coded_length, words_len = struct.unpack(WordDictionaryHeader.LENGTHS_FMT, lengths_bytes)
+        words = {}
+        for _ in range(words_len):
+            code = f.read(1).decode('iso-8859-1')
+            words[code] = WordDictionaryHeader._read_string(f)
+        return WordDictionaryHeader(WordDictionary(words, coded_length))
+
+    @staticmethod
+    def _read_string(f):
+        res = []
+        while True:
+            c = f.read(1)
+            if len(c) == 0:
+                raise Exception('Unexpected end of word dictionary')
+            if c == b'\0':
+                break
+            res.append(c.decode('iso-8859-1'))
+        return ''.join(res)
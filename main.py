@@ -1,12 +1,29 @@
 import os
 import sys
+import json
 import argparse
-from coding.codec import StatisticEncoder, StatisticDecoder
-from coding.coding_params import CodingParams, UpCharCodingAlrorithm
-from coding.capitalization import get_cap_data, capitalize_iter, decapitalize_iter
+import glob
+import time
+import collections
+import mmap
+import dataclasses
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, List, Tuple
+from coding.coding_params import CodingParams
+from coding.stats import CodingStats
+from coding.deadline import DeadlinePacer
+from coding.stream import encode_stream, decode_stream, estimate_stream
 from headers.header import Header
-from headers.capitalization_header import CapitalizationHeader
-from utils.iter_utils import iter_chars, write_chars, iter_bits, write_bits
+import solid_archive
+import pipeline
+import daemon
+from utils.iter_utils import iter_chars, write_chars, iter_buffer_chars, write_chars_to_buffer
+from utils.cli_args import add_coding_params_args, coding_params_from_args
+
+MAX_PREALLOCATE_RATIO = 64  # unzip: Header.length / archive size above this isn't preallocated
+
 
 def open_or_stdout(filename, **kwargs):
     if filename != '-':
@@ -20,63 +37,311 @@ def open_or_stdin(filename, **kwargs):
     return os.fdopen(sys.stdin.fileno(), closefd=False, **kwargs)
 
 
-def zip(source_file, dest_file, coding_params: CodingParams = CodingParams()):
+# regular non-empty files only, mmap can't do pipes and empty files
+def is_mappable(filename):
+    return filename != '-' and os.path.isfile(filename) and os.path.getsize(filename) > 0
+
+
+# pacer (deadline mode) needs coding_params.segmented
+def zip(source_file, dest_file, coding_params: CodingParams = CodingParams(), stats: Optional[CodingStats] = None,
+        pipelined=False, pacer: Optional[DeadlinePacer] = None):
+    if pipelined:
+        source_length = os.path.getsize(source_file)
+        with open_or_stdin(source_file, mode='r', encoding='iso-8859-1', newline='') as input_f, \
+                open_or_stdout(dest_file, mode='wb') as dest_f:
+            pipeline.encode_pipelined(input_f, source_length, dest_f, coding_params, stats, pacer)
+        return
+
+    if is_mappable(source_file):
+        with open(source_file, mode='rb') as input_f, \
+                mmap.mmap(input_f.fileno(), 0, access=mmap.ACCESS_READ) as source, \
+                open_or_stdout(dest_file, mode='wb') as dest_f:
+            encode_stream(lambda: iter_buffer_chars(source), len(source), dest_f, coding_params, stats, pacer)
+        return
+
     source_length = os.path.getsize(source_file)  # race condition, also not sure about precision
-    header = Header(source_length, coding_params)
     with open_or_stdin(source_file, mode='r', encoding='iso-8859-1', newline='') as input_f, \
             open_or_stdout(dest_file, mode='wb') as dest_f:
 
-        cap_data = None
-        if header.coding_params.decapitalize:
-            cap_data = get_cap_data(iter_chars(input_f))
+        passes = 0
+
+        def iter_source():
+            nonlocal passes
+            if passes > 0:
+                input_f.seek(0)
+            passes += 1
+            return iter_chars(input_f)
+
+        encode_stream(iter_source, source_length, dest_f, coding_params, stats, pacer)
+
+
+# into a preallocated mmap of Header.length bytes when both sides are regular files and the length is plausible
+# (a corrupted header shouldn't make a file of any size), written as decoded otherwise.
+# jobs: processes that decode the segments of a semi-static archive, the others are decoded by one anyway
+def unzip(source_file, dest_file, stats: Optional[CodingStats] = None, pipelined=False, jobs: Optional[int] = 1):
+    with open_or_stdin(source_file, mode='rb') as input_f:
+        if pipelined:
+            with open_or_stdout(dest_file, mode='w', encoding='iso-8859-1', newline='') as dest_f:
+                pipeline.decode_pipelined(input_f, dest_f, stats)
+            return
+
+        length = None
+        if dest_file != '-' and input_f.seekable():
+            length = Header.deserialize(input_f.read(Header.header_length())).length
             input_f.seek(0)
+        if length is None or length > MAX_PREALLOCATE_RATIO * os.fstat(input_f.fileno()).st_size:
+            with open_or_stdout(dest_file, mode='w', encoding='iso-8859-1', newline='') as dest_f:
+                write_chars(decode_stream(input_f, stats, jobs), dest_f)
+            return
+
+        with open(dest_file, mode='w+b') as dest_f:
+            dest_f.truncate(length)
+            if length == 0:
+                collections.deque(decode_stream(input_f, stats, jobs), maxlen=0)  # still checks the trailer
+                return
+            with mmap.mmap(dest_f.fileno(), length) as dest:
+                written = write_chars_to_buffer(decode_stream(input_f, stats, jobs), dest)
+        if written != length:
+            raise Exception(f'Decoded {written} chars instead of {length}')
+
 
-        dest_f.write(header.serialize())
-        if cap_data is not None:
-            dest_f.write(CapitalizationHeader(cap_data).serialize())
+# decodes without writing anything, raises on a corrupted archive
+def verify(source_file, stats: Optional[CodingStats] = None, jobs: Optional[int] = None):
+    if solid_archive.is_solid_archive(source_file):
+        solid_archive.verify(source_file, jobs)
+        return
 
-        iter_char = iter_chars(input_f) if not header.coding_params.decapitalize \
-            else decapitalize_iter(iter_chars(input_f))
-        encoder = StatisticEncoder(iter_char, coding_params)
-        write_bits(encoder.encode(), dest_f)
+    with open_or_stdin(source_file, mode='rb') as input_f:
+        collections.deque(decode_stream(input_f, stats, jobs), maxlen=0)
+
+
+# archive size zip would produce, without coding or writing anything; the model walk is left in stats
+def estimate(source_file, coding_params: CodingParams = CodingParams(), stats: Optional[CodingStats] = None) -> int:
+    stats = stats or CodingStats()
+    if is_mappable(source_file):
+        with open(source_file, mode='rb') as input_f, \
+                mmap.mmap(input_f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            return estimate_stream(lambda: iter_buffer_chars(source), len(source), coding_params, stats)
+
+    with open(source_file, mode='r', encoding='iso-8859-1', newline='') as input_f:
+        def iter_source():
+            input_f.seek(0)
+            return iter_chars(input_f)
 
+        return estimate_stream(iter_source, os.path.getsize(source_file), coding_params, stats)
 
-def unzip(source_file, dest_file):
-    with open_or_stdin(source_file, mode='rb') as input_f, \
-            open_or_stdout(dest_file, mode='w', encoding='iso-8859-1', newline='') as dest_f:
 
-        header = Header.deserialize(input_f.read(Header.header_length()))
+def print_estimate(source_file, length, size, stats: CodingStats, per_order):
+    bits_per_char = size * 8 / length if length > 0 else 0
+    print(f'{source_file}: {length} -> ~{size} bytes, {bits_per_char:.3f} bits/char')
+    if not per_order:
+        return
+    print(f'{"order":>6} {"chars":>10} {"escapes":>10} {"bits":>12} {"bits/char":>10}')
+    for order in sorted(stats.bits_per_order.keys() | stats.chars_per_order.keys()):
+        chars = stats.chars_per_order.get(order, 0)
+        bits = stats.bits_per_order.get(order, 0)
+        print(f'{order:>6} {chars:>10} {stats.escapes_per_order.get(order, 0):>10} {bits:>12.1f} '
+              f'{bits / chars if chars > 0 else 0:>10.3f}')
+    if stats.match_flags > 0:
+        print(f'{"match":>6} {stats.match_hits:>10} {stats.match_flags - stats.match_hits:>10} '
+              f'{stats.match_bits:>12.1f}')
 
-        cap_data = None
-        if header.coding_params.decapitalize:
-            cap_data = CapitalizationHeader.deserialize(input_f).cap_data
 
-        decoder = StatisticDecoder(iter_bits(input_f), header.length, header.coding_params)
+@dataclass
+class BatchTask:
+    source_file: str
+    dest_file: str
+    error: Optional[str] = None  # a manifest line that isn't a task, reported as a failed one
 
-        iter_char = decoder.decode() if not header.coding_params.decapitalize \
-            else capitalize_iter(decoder.decode(), cap_data)
-        write_chars(iter_char, dest_f)
+
+@dataclass
+class BatchResult:
+    ok: int
+    failed: List[Tuple[BatchTask, str]]
+    source_bytes: int
+    dest_bytes: int
+    text_bytes: int  # uncompressed side, for throughput
+    time_s: float
+
+    def throughput(self):
+        return self.text_bytes / self.time_s if self.time_s > 0 else 0
+
+
+# Either a glob (outputs go to dest_dir) or a manifest file with one "source<TAB>dest" pair per line
+def read_batch_tasks(source, dest_dir, mode) -> List[BatchTask]:
+    if not glob.has_magic(source):
+        with open(source, encoding='utf-8') as f:
+            lines = [line.rstrip('\n') for line in f]
+        tasks = []
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            fields = line.split('\t')
+            tasks.append(BatchTask(*fields) if len(fields) == 2 else
+                         BatchTask(line, '', f'{source}:{line_no}: expected "source<TAB>dest"'))
+        return tasks
+
+    if dest_dir is None:
+        raise Exception('Batch with a glob needs a destination directory')
+    tasks = []
+    for source_file in sorted(glob.glob(source)):
+        name = os.path.basename(source_file)
+        if mode == 'zip':
+            name = f'{name}.zip'
+        else:
+            name = name[:-len('.zip')] if name.endswith('.zip') else f'{name}.unzipped'
+        tasks.append(BatchTask(source_file, os.path.join(dest_dir, name)))
+    return tasks
+
+
+# Worker processes are reused between files, so imports are paid once per worker, not once per file.
+# A failed file doesn't stop the batch, and neither does a bad manifest line or a worker that died
+# (a broken pool fails every task that hadn't finished)
+def batch(tasks: List[BatchTask], mode, coding_params: CodingParams = CodingParams(), jobs: Optional[int] = None,
+          on_done=None) -> BatchResult:
+    result = BatchResult(0, [], 0, 0, 0, 0)
+    t0 = time.perf_counter()
+    for task in tasks:
+        if task.error is not None:
+            result.failed.append((task, task.error))
+            if on_done is not None:
+                on_done(task, task.error)
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = {executor.submit(_batch_task, mode, task, coding_params): task for task in tasks
+                   if task.error is None}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                error, sizes = future.result()
+            except BrokenProcessPool as e:
+                error, sizes = f'{e.__class__.__name__}: {e}', None
+            if error is None:
+                result.ok += 1
+                result.source_bytes += sizes[0]
+                result.dest_bytes += sizes[1]
+                result.text_bytes += sizes[0] if mode == 'zip' else sizes[1]
+            else:
+                result.failed.append((task, error))
+            if on_done is not None:
+                on_done(task, error)
+    result.time_s = time.perf_counter() - t0
+    return result
+
+
+def _batch_task(mode, task: BatchTask, coding_params):
+    try:
+        if mode == 'zip':
+            zip(task.source_file, task.dest_file, coding_params)
+        else:
+            unzip(task.source_file, task.dest_file)
+        return None, (os.path.getsize(task.source_file), os.path.getsize(task.dest_file))
+    except Exception as e:
+        if os.path.exists(task.dest_file):
+            os.remove(task.dest_file)
+        return f'{e.__class__.__name__}: {e}', None
 
 
 def console_app():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('mode', type=str, choices=['zip', 'unzip'])
-    parser.add_argument('source_file', type=str)
-    parser.add_argument('dest_file', type=str)
-    parser.add_argument('-K', '--ctx_length', type=int, default=5)
-    parser.add_argument('-m', '--mask', type=bool, default=True)
-    parser.add_argument('-e', '--exclude', type=bool, default=False)
-    parser.add_argument('-u', '--up_algo', type=str, choices=['A', 'B', 'C', 'D'], default='D')
-    parser.add_argument('-c', '--decapitalize', type=bool, default=False)
+    parser.add_argument('mode', type=str, choices=['zip', 'unzip', 'test', 'pack', 'list', 'extract', 'batch',
+                                                         'daemon', 'estimate'])
+    parser.add_argument('source_file', type=str,
+                        help='directory for pack, manifest or glob for batch, socket path for daemon, '
+                             'file or glob for estimate, archive otherwise')
+    parser.add_argument('dest_file', type=str, nargs='?',
+                        help='directory for extract and glob batch, not needed for test/list')
+    add_coding_params_args(parser)
+    parser.add_argument('--stats', action='store_true', help='print model/coder counters as JSON to stderr')
+    parser.add_argument('--progress', action='store_true', help='print throughput/progress to stderr')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='zip/unzip: I/O in threads and capitalization in a process, next to the coder')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='zip: seconds the whole job should take, max order/masking go down to meet it; '
+                             'the text is written in 16K segments (no stored ones unless --stored)')
+    parser.add_argument('--throughput', type=float, default=None,
+                        help='zip: same as --deadline, but as a target speed in KB/s')
+    parser.add_argument('--solid_size', type=int, default=solid_archive.DEFAULT_SOLID_SIZE,
+                        help='pack: bytes of files sharing one model, 0 for a group per file')
+    parser.add_argument('--files', type=str, nargs='*', help='extract: only these entries')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='test/batch/daemon/unzip: worker processes, cpu count by default '
+                             '(unzip: semi-static archives only)')
+    parser.add_argument('--batch_mode', type=str, choices=['zip', 'unzip'], default='zip')
 
     args = parser.parse_args()
+    if args.throughput is not None and args.source_file == '-':
+        parser.error('--throughput needs the length of the text up front, stdin (-) doesn\'t have one')
+
+    stats = None
+    if args.stats or args.progress:
+        stats = CodingStats(on_progress=print_progress if args.progress else None)
+
+    coding_params = coding_params_from_args(args)
     if args.mode == 'zip':
-        zip(args.source_file, args.dest_file,
-            CodingParams(args.ctx_length, args.mask, args.exclude,
-                         UpCharCodingAlrorithm.from_letter(args.up_algo), args.decapitalize))
+        pacer = None
+        if args.deadline is not None or args.throughput is not None:
+            coding_params = dataclasses.replace(coding_params, segmented=True)  # levels are per segment
+            pacer = DeadlinePacer(args.deadline, coding_params) if args.deadline is not None else \
+                DeadlinePacer.for_throughput(args.throughput * 1024, os.path.getsize(args.source_file), coding_params)
+        zip(args.source_file, args.dest_file, coding_params, stats, args.pipelined, pacer)
     elif args.mode == 'unzip':
-        unzip(args.source_file, args.dest_file)
+        unzip(args.source_file, args.dest_file, stats, args.pipelined, args.jobs)
+    elif args.mode == 'pack':
+        solid_archive.pack(args.source_file, args.dest_file, coding_params, args.solid_size)
+    elif args.mode == 'list':
+        for entry in solid_archive.list_entries(args.source_file).entries:
+            print(f'{entry.length:12} {entry.group:6} {entry.name}')
+    elif args.mode == 'extract':
+        solid_archive.extract(args.source_file, args.dest_file or '.', args.files)
+    elif args.mode == 'batch':
+        tasks = read_batch_tasks(args.source_file, args.dest_file, args.batch_mode)
+        result = batch(tasks, args.batch_mode, coding_params, args.jobs, on_done=print_batch_task)
+        print(f'{result.ok} ok, {len(result.failed)} failed, {result.source_bytes} -> {result.dest_bytes} bytes '
+              f'in {result.time_s:.1f}s, {result.throughput() / 1024:.1f} KB/s', file=sys.stderr)
+        if result.failed:
+            sys.exit(1)
+    elif args.mode == 'daemon':
+        daemon.serve(args.source_file, args.jobs)
+    elif args.mode == 'estimate':
+        source_files = sorted(glob.glob(args.source_file)) if glob.has_magic(args.source_file) else [args.source_file]
+        total_length, total_size = 0, 0
+        for source_file in source_files:
+            stats = CodingStats(on_progress=print_progress if args.progress else None)
+            size = estimate(source_file, coding_params, stats)
+            if args.progress:
+                print(file=sys.stderr)
+            print_estimate(source_file, os.path.getsize(source_file), size, stats, per_order=len(source_files) == 1)
+            total_length += os.path.getsize(source_file)
+            total_size += size
+        if len(source_files) > 1:
+            print(f'total: {total_length} -> ~{total_size} bytes, '
+                  f'{total_size * 8 / total_length if total_length > 0 else 0:.3f} bits/char')
+    elif args.mode == 'test':
+        try:
+            verify(args.source_file, stats, args.jobs)
+        except Exception as e:
+            print(f'{args.source_file}: FAILED ({e.__class__.__name__}: {e})', file=sys.stderr)
+            sys.exit(1)
+        print(f'{args.source_file}: OK', file=sys.stderr)
+
+    if args.progress:
+        print(file=sys.stderr)
+    if args.stats:
+        print(json.dumps(stats.to_dict(), indent=2), file=sys.stderr)
+
+
+def print_batch_task(task: BatchTask, error):
+    if error is None:
+        print(f'OK     {task.source_file} -> {task.dest_file}', file=sys.stderr)
+    else:
+        print(f'FAILED {task.source_file}: {error}', file=sys.stderr)
+
+
+def print_progress(stats: CodingStats):
+    progress = stats.progress()
+    progress_fmt = f'{progress * 100:5.1f}%, ' if progress is not None else ''
+    print(f'\r{progress_fmt}{stats.symbols} chars, {stats.throughput() / 1024:.1f} KB/s', end='', file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,294 @@
+# Micro-benchmarks for the hot primitives, one layer at a time:
+#
+#   python micro_benchmark.py                 # everything
+#   python micro_benchmark.py fenwick range   # only benchmarks whose name starts with one of the prefixes
+#
+# Workloads are synthetic and seeded, so numbers from different commits are comparable.
+# ns/op is the best of several runs minus the loop overhead; allocations are measured in a separate run under
+# tracemalloc (CPython has no allocation counter, so it's "peak bytes above baseline during one op" and
+# "blocks still alive after the run", both per op)
+
+import io
+import gc
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Tuple, List
+
+from coding.coding_params import CodingParams
+from coding.context_tree import LeftContextTree
+from coding.hashed_context import HashedContextTable
+from coding.mixing import MixingModel
+from coding.bit_number_range import BitNumberRange, DecoderWithRange
+from utils.fenwick_utils import ExtendableFenwickTree
+from utils.iter_utils import iter_bits, write_bits, iter_chars, write_chars, bits_to_bytes
+from utils.ternary_encoding import encode_numbers, decode_numbers
+
+SEED = 2024
+OPS = 2000
+
+
+@dataclass
+class MicroBenchmarkResult:
+    name: str
+    ops: int
+    ns_per_op: float
+    peak_bytes_per_op: float
+    live_blocks_per_op: float
+
+    def fmt(self):
+        return f'{self.name:40} {self.ns_per_op:12.0f} {self.peak_bytes_per_op:12.1f} {self.live_blocks_per_op:12.2f}'
+
+
+# setup() -> (op, ops): op(i) runs the i-th operation of a fresh workload
+Setup = Callable[[], Tuple[Callable[[int], object], int]]
+
+
+def synthetic_text(length, seed=SEED):
+    # words from a small vocabulary, so that contexts repeat like in real text
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choice('etaoinshrdlucmfwyp') for _ in range(rnd.randint(1, 8))) for _ in range(300)]
+    text = []
+    while sum(map(len, text)) < length:
+        text.append(rnd.choice(words))
+        text.append(rnd.choice('      ,.\n'))
+    return ''.join(text)[:length]
+
+
+def synthetic_fenwick(length, rnd):
+    tree = ExtendableFenwickTree(length)
+    for i in range(length):
+        tree.add(i, rnd.randint(1, 50))
+    return tree
+
+
+def fenwick_add():
+    rnd = random.Random(SEED)
+    tree = synthetic_fenwick(256, rnd)
+    indices = [rnd.randrange(256) for _ in range(OPS)]
+    return lambda i: tree.add(indices[i], 1), OPS
+
+
+def fenwick_append():
+    trees = [ExtendableFenwickTree(1) for _ in range(OPS // 64)]
+    return lambda i: trees[i // 64].append(1), OPS // 64 * 64
+
+
+def fenwick_prefix_sum():
+    rnd = random.Random(SEED)
+    tree = synthetic_fenwick(256, rnd)
+    stops = [rnd.randint(0, 256) for _ in range(OPS)]
+    return lambda i: tree.prefix_sum(stops[i]), OPS
+
+
+def fenwick_without_chars():
+    rnd = random.Random(SEED)
+    chars = [chr(c) for c in range(64)]
+    tree = synthetic_fenwick(64, rnd)
+    chars_to_indices = {c: i for i, c in enumerate(chars)}
+    excluded = [set(rnd.sample(chars, 16)) for _ in range(OPS // 4)]
+    find_chars = [rnd.choice(chars) for _ in range(OPS // 4)]
+    return lambda i: tree.without_chars(excluded[i], chars_to_indices, find_char_idx=find_chars[i]), OPS // 4
+
+
+def coding_steps(ops, rnd):
+    distributions = [synthetic_fenwick(rnd.randint(2, 64), rnd) for _ in range(16)]
+    steps = []
+    for _ in range(ops):
+        distribution = rnd.choice(distributions)
+        steps.append((distribution, rnd.randrange(len(distribution))))
+    return steps
+
+
+def range_project_probability_pop_prefix():
+    steps = coding_steps(OPS, random.Random(SEED))
+    number_range = BitNumberRange()
+    return lambda i: number_range.project_probability_pop_prefix(*steps[i]), OPS
+
+
+def decoder_get_next_char_idx():
+    steps = coding_steps(OPS, random.Random(SEED))
+    encoding_range = BitNumberRange()
+    bits = [bit for step in steps for bit in encoding_range.project_probability_pop_prefix(*step)]
+    bits.extend(encoding_range.get_nonzero_prefix_from_range())
+
+    decoder = DecoderWithRange(iter(bits))
+    return lambda i: decoder.get_next_char_idx(steps[i][0]), OPS
+
+
+def tree_symbols(text, coding_params):
+    # (left context, char) pairs as seen by LeftContextTree while coding text
+    context_length = coding_params.context_length
+    return [(text[max(0, i - context_length):i], text[i]) for i in range(len(text))]
+
+
+def context_tree_go_down():
+    coding_params = CodingParams(context_length=5)
+    tree = LeftContextTree(coding_params)
+    symbols = tree_symbols(synthetic_text(OPS * 5), coding_params)
+    for left_ctx, c in symbols:
+        ctx = tree._go_down(left_ctx)
+        tree._update_tree(left_ctx, c, ctx, ctx)
+    return lambda i: tree._go_down(symbols[i][0]), OPS
+
+
+def context_tree_update_tree():
+    coding_params = CodingParams(context_length=5)
+    tree = LeftContextTree(coding_params)
+    symbols = tree_symbols(synthetic_text(OPS), coding_params)
+
+    # includes the _go_down that finds the contexts to update, subtract context_tree._go_down for the pure update
+    def op(i):
+        left_ctx, c = symbols[i]
+        ctx = tree._go_down(left_ctx)
+        tree._update_tree(left_ctx, c, ctx, ctx)
+
+    return op, OPS
+
+
+# whole encode of a char (contexts, distributions, update), for comparing the tree with the hashed tables
+def model_encode(tree):
+    text = synthetic_text(OPS * 5)
+    for c in text[:-OPS]:
+        for _ in tree.encode(c):
+            pass
+    symbols = text[-OPS:]
+    return lambda i: list(tree.encode(symbols[i])), OPS
+
+
+def context_tree_encode():
+    return model_encode(LeftContextTree(CodingParams(context_length=5)))
+
+
+def hashed_context_encode():
+    return model_encode(HashedContextTable(CodingParams(context_length=5, hash_bits=16)))
+
+
+def mixing_encode():
+    coding_params = CodingParams(context_length=5, mixing=True)
+    return model_encode(MixingModel(LeftContextTree(coding_params), coding_params))
+
+
+def iter_utils_iter_bits():
+    data = random.Random(SEED).randbytes(OPS // 8)
+    bits = iter_bits(io.BytesIO(data))
+    return lambda i: next(bits), OPS // 8 * 8
+
+
+def iter_utils_write_bits():
+    rnd = random.Random(SEED)
+    chunks = [[rnd.randint(0, 1) for _ in range(64)] for _ in range(OPS // 64)]
+    out = io.BytesIO()
+    return lambda i: write_bits(iter(chunks[i]), out), OPS // 64
+
+
+def iter_utils_bits_to_bytes():
+    rnd = random.Random(SEED)
+    chunks = [[rnd.randint(0, 1) for _ in range(64)] for _ in range(OPS // 64)]
+    return lambda i: bits_to_bytes(chunks[i]), OPS // 64
+
+
+def iter_utils_iter_chars():
+    text = synthetic_text(OPS)
+    chars = iter_chars(io.StringIO(text))
+    return lambda i: next(chars), OPS
+
+
+def iter_utils_write_chars():
+    texts = [synthetic_text(64, seed=SEED + i) for i in range(OPS // 64)]
+    out = io.StringIO()
+    return lambda i: write_chars(iter(texts[i]), out), OPS // 64
+
+
+def ternary_encode_numbers():
+    rnd = random.Random(SEED)
+    nums = [rnd.randint(0, 10 ** 6) for _ in range(OPS)]
+    return lambda i: list(encode_numbers([nums[i]])), OPS
+
+
+def ternary_decode_numbers():
+    rnd = random.Random(SEED)
+    nums = [rnd.randint(0, 10 ** 6) for _ in range(OPS)]
+    decoded = decode_numbers(iter(list(encode_numbers(nums))))
+    return lambda i: next(decoded), OPS
+
+
+BENCHMARKS: List[Tuple[str, Setup]] = [
+    ('fenwick.add', fenwick_add),
+    ('fenwick.append', fenwick_append),
+    ('fenwick.prefix_sum', fenwick_prefix_sum),
+    ('fenwick.without_chars', fenwick_without_chars),
+    ('range.project_probability_pop_prefix', range_project_probability_pop_prefix),
+    ('decoder.get_next_char_idx', decoder_get_next_char_idx),
+    ('context_tree._go_down', context_tree_go_down),
+    ('context_tree._update_tree', context_tree_update_tree),
+    ('context_tree.encode', context_tree_encode),
+    ('hashed_context.encode', hashed_context_encode),
+    ('mixing.encode', mixing_encode),
+    ('iter_utils.iter_bits', iter_utils_iter_bits),
+    ('iter_utils.write_bits[64 bits]', iter_utils_write_bits),
+    ('iter_utils.bits_to_bytes[64 bits]', iter_utils_bits_to_bytes),
+    ('iter_utils.iter_chars', iter_utils_iter_chars),
+    ('iter_utils.write_chars[64 chars]', iter_utils_write_chars),
+    ('ternary.encode_numbers', ternary_encode_numbers),
+    ('ternary.decode_numbers', ternary_decode_numbers),
+]
+
+
+def time_ns_per_op(setup: Setup, repeat) -> float:
+    best = None
+    for _ in range(repeat):
+        op, ops = setup()
+        gc.collect()
+        gc.disable()
+        t0 = time.perf_counter_ns()
+        for i in range(ops):
+            op(i)
+        t1 = time.perf_counter_ns()
+        gc.enable()
+        best = (t1 - t0) / ops if best is None else min(best, (t1 - t0) / ops)
+    return best
+
+
+def allocations_per_op(setup: Setup) -> Tuple[float, float]:
+    op, ops = setup()
+    gc.collect()
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    peak_total = 0
+    for i in range(ops):
+        tracemalloc.reset_peak()
+        (current, _) = tracemalloc.get_traced_memory()
+        op(i)
+        (_, peak) = tracemalloc.get_traced_memory()
+        peak_total += peak - current
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+    return peak_total / ops, (blocks_after - blocks_before) / ops
+
+
+def run_benchmark(name, setup: Setup, repeat=5) -> MicroBenchmarkResult:
+    loop_overhead = time_ns_per_op(lambda: (lambda i: None, OPS), repeat)
+    ns_per_op = time_ns_per_op(setup, repeat) - loop_overhead
+    peak_bytes_per_op, live_blocks_per_op = allocations_per_op(setup)
+    return MicroBenchmarkResult(name, setup()[1], ns_per_op, peak_bytes_per_op, live_blocks_per_op)
+
+
+def console_app():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('names', type=str, nargs='*', help='benchmark name prefixes, all if empty')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"benchmark":40} {"ns/op":>12} {"peak B/op":>12} {"blocks/op":>12}')
+    for name, setup in BENCHMARKS:
+        if args.names and not any(name.startswith(prefix) for prefix in args.names):
+            continue
+        print(run_benchmark(name, setup, args.repeat).fmt())
+
+
+if __name__ == '__main__':
+    console_app()
@@ -0,0 +1,192 @@
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import threading
+from typing import Optional
+from coding.coding_params import CodingParams
+from coding.deadline import DeadlinePacer
+from coding.capitalization import get_cap_data, capitalize_iter
+from coding.semi_static import build_semi_static_model
+from coding.stats import CodingStats
+from coding.stream import StreamHeaders, decapitalized_source, model_source, encode_bits, decode_chars, check_trailer
+from coding.word_dictionary import build_word_dictionary
+from headers.header import Header
+from headers.checksum_trailer import ChecksumTrailer
+from utils.checksum import Crc32
+from utils.iter_utils import iter_chars, iter_str_chunks, TailHoldingReader, QueueReader, QueueWriter
+
+# Same archives as coding/stream.py, but reading, writing and (de)capitalization run next to the coder
+# instead of inside its generator chain: threads for I/O (they mostly wait on the OS, the GIL is free then),
+# a process for capitalization (pure python, would fight the coder for the GIL).
+# Stages are connected by bounded queues of big chunks, so a slow stage stalls the ones before it
+
+PIPELINE_CHUNK_SIZE = 64 * 1024  # chars or bytes per queue item
+PIPELINE_QUEUE_SIZE = 8  # chunks in flight between two stages
+PROCESS_POLL_S = 1
+PENDING_SPOOL_SIZE = 16 * PIPELINE_CHUNK_SIZE  # coded bytes waiting for the capitalization header kept in memory
+
+_END = None
+
+
+# remembers what it raised, so that the main thread can re-raise it
+class _Stage(threading.Thread):
+    def __init__(self, fn, *args):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.args = args
+        self.error: Optional[BaseException] = None
+        self.start()
+
+    def run(self):
+        try:
+            self.fn(*self.args)
+        except BaseException as e:
+            self.error = e
+
+    def join_and_raise(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+def encode_pipelined(input_f, length, dest_f, coding_params: CodingParams, stats: Optional[CodingStats] = None,
+                     pacer: Optional[DeadlinePacer] = None):
+    headers = StreamHeaders(Header(length, coding_params))
+    if coding_params.word_dictionary:
+        # needs the whole text before the first coded char, can't overlap with anything
+        headers.dictionary = build_word_dictionary(decapitalized_source(iter_chars(input_f), coding_params))
+        input_f.seek(0)
+    if coding_params.semi_static:
+        # same, a whole pass before the first coded char
+        headers.model = build_semi_static_model(model_source(iter_chars(input_f), headers), coding_params)
+        input_f.seek(0)
+
+    text_q = queue.Queue(PIPELINE_QUEUE_SIZE)
+    coded_q = queue.Queue(PIPELINE_QUEUE_SIZE)
+    cap_process, cap_in_q, cap_out_q = None, None, None
+    if coding_params.decapitalize:
+        cap_in_q, cap_out_q = multiprocessing.Queue(PIPELINE_QUEUE_SIZE), multiprocessing.Queue(1)
+        cap_process = multiprocessing.Process(target=_cap_data_worker, args=(cap_in_q, cap_out_q), daemon=True)
+        cap_process.start()
+
+    try:
+        checksum = Crc32()
+        reader = _Stage(_read_text, input_f, checksum, coding_params.decapitalize, text_q, cap_in_q)
+        writer = _Stage(_write_coded, coded_q, dest_f, headers, cap_process, cap_out_q)
+
+        iter_char = (c for chunk in iter(text_q.get, _END) for c in chunk)
+        encode_bits(iter_char, headers, QueueWriter(coded_q.put), stats, pacer)
+        coded_q.put(_END)
+
+        reader.join_and_raise()
+        writer.join_and_raise()
+        dest_f.write(ChecksumTrailer(checksum.value).serialize())
+    finally:
+        if cap_process is not None:
+            cap_process.terminate()
+
+
+def decode_pipelined(input_f, dest_f, stats: Optional[CodingStats] = None):
+    coded_q = queue.Queue(PIPELINE_QUEUE_SIZE)
+    reader = _Stage(_read_coded, input_f, coded_q)
+    coded_f = TailHoldingReader(QueueReader(coded_q.get), ChecksumTrailer.trailer_length())
+    headers = StreamHeaders.read(coded_f)
+
+    cap_process = None
+    if headers.cap_data is not None:
+        text_q, capitalized_q = multiprocessing.Queue(PIPELINE_QUEUE_SIZE), multiprocessing.Queue(PIPELINE_QUEUE_SIZE)
+        cap_process = multiprocessing.Process(target=_capitalize_worker,
+                                              args=(headers.cap_data, text_q, capitalized_q), daemon=True)
+        cap_process.start()
+    else:
+        text_q = capitalized_q = queue.Queue(PIPELINE_QUEUE_SIZE)
+
+    try:
+        checksum = Crc32()
+        writer = _Stage(_write_text, capitalized_q, cap_process, dest_f, checksum)
+
+        for chunk in iter_str_chunks(decode_chars(coded_f, headers, stats), PIPELINE_CHUNK_SIZE):
+            text_q.put(chunk)
+        text_q.put(_END)
+
+        writer.join_and_raise()
+        check_trailer(coded_f, checksum)
+        reader.join_and_raise()
+    finally:
+        if cap_process is not None:
+            cap_process.terminate()
+
+
+def _read_text(input_f, checksum: Crc32, decapitalize, text_q, cap_in_q):
+    while True:
+        chunk = input_f.read(PIPELINE_CHUNK_SIZE)
+        if not chunk:
+            break
+        checksum.update(chunk)
+        if cap_in_q is not None:
+            cap_in_q.put(chunk)
+        text_q.put(chunk.lower() if decapitalize else chunk)  # same as decapitalize_iter, but for the whole chunk
+    if cap_in_q is not None:
+        cap_in_q.put(_END)
+    text_q.put(_END)
+
+
+# the capitalization header goes before the coded bits, so they wait here until the capitalization
+# process is done; they are never held in the queue, otherwise the coder would stall. Nor can the coder be made
+# to wait: capitalization needs the whole text, which the reader only gets through while the coder takes it.
+# So they wait in a temp file, past PENDING_SPOOL_SIZE on disk
+def _write_coded(coded_q, dest_f, headers: StreamHeaders, cap_process, cap_out_q):
+    with tempfile.SpooledTemporaryFile(PENDING_SPOOL_SIZE) as pending:
+        headers_written = False
+        while True:
+            chunk = coded_q.get()
+            if not headers_written and (cap_out_q is None or chunk is _END or not cap_out_q.empty()):
+                if cap_out_q is not None:
+                    headers.cap_data = _get_from_process(cap_out_q, cap_process)
+                headers.write(dest_f)
+                pending.seek(0)
+                shutil.copyfileobj(pending, dest_f, PIPELINE_CHUNK_SIZE)
+                headers_written = True
+            if chunk is _END:
+                return
+            (dest_f if headers_written else pending).write(chunk)
+
+
+def _read_coded(input_f, coded_q):
+    while True:
+        chunk = input_f.read(PIPELINE_CHUNK_SIZE)
+        if not chunk:
+            break
+        coded_q.put(chunk)
+    coded_q.put(_END)
+
+
+def _write_text(text_q, cap_process, dest_f, checksum: Crc32):
+    while True:
+        chunk = _get_from_process(text_q, cap_process) if cap_process is not None else text_q.get()
+        if chunk is _END:
+            return
+        checksum.update(chunk)
+        dest_f.write(chunk)
+
+
+def _cap_data_worker(cap_in_q, cap_out_q):
+    cap_out_q.put(get_cap_data(c for chunk in iter(cap_in_q.get, _END) for c in chunk))
+
+
+def _capitalize_worker(cap_data, text_q, capitalized_q):
+    iter_char = (c for chunk in iter(text_q.get, _END) for c in chunk)
+    for chunk in iter_str_chunks(capitalize_iter(iter_char, cap_data), PIPELINE_CHUNK_SIZE):
+        capitalized_q.put(chunk)
+    capitalized_q.put(_END)
+
+
+# a dead process would otherwise leave q.get() waiting forever
+def _get_from_process(q, process):
+    while True:
+        try:
+            return q.get(timeout=PROCESS_POLL_S)
+        except queue.Empty:
+            if not process.is_alive():
+                raise Exception(f'Capitalization process exited with code {process.exitcode}')
@@ -0,0 +1,165 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Iterable
+from coding.coding_params import CodingParams
+from coding.stream import encode_stream, decode_stream
+from headers.entry_table import EntryTable, ArchiveEntry, SolidGroup
+from headers.checksum_trailer import ChecksumError
+from utils.iter_utils import iter_chars, RangeReader, StrIterReader
+from utils.checksum import Crc32
+
+DEFAULT_SOLID_SIZE = 16 * 1024 * 1024
+EXTRACT_CHUNK_SIZE = 64 * 1024
+
+
+def is_solid_archive(path) -> bool:
+    if path == '-' or not os.path.isfile(path):
+        return False
+    with open(path, mode='rb') as f:
+        return f.read(len(EntryTable.MAGIC)) == EntryTable.MAGIC
+
+
+# same extensions next to each other, so that a solid group is more likely to have similar texts
+def list_source_files(source_dir) -> List[str]:
+    names = []
+    for dir_path, _, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            names.append(os.path.relpath(os.path.join(dir_path, file_name), source_dir).replace(os.sep, '/'))
+    return sorted(names, key=lambda name: (os.path.splitext(name)[1], name))
+
+
+# consecutive files until the group is at least solid_size long; solid_size 0 puts every file in its own group
+def plan_groups(lengths: List[int], solid_size) -> List[List[int]]:
+    groups = []
+    group_length = 0
+    for i, length in enumerate(lengths):
+        if len(groups) == 0 or group_length >= max(solid_size, 1):
+            groups.append([])
+            group_length = 0
+        groups[-1].append(i)
+        group_length += length
+    return groups
+
+
+def pack(source_dir, dest_file, coding_params: CodingParams = CodingParams(), solid_size=DEFAULT_SOLID_SIZE):
+    names = list_source_files(source_dir)
+    lengths = [os.path.getsize(os.path.join(source_dir, name)) for name in names]
+
+    groups = []
+    entries = []
+    with open(dest_file, mode='wb') as dest_f:
+        dest_f.write(EntryTable.MAGIC)
+
+        for group_idx, file_indices in enumerate(plan_groups(lengths, solid_size)):
+            group_names = [names[i] for i in file_indices]
+            group_lengths = [lengths[i] for i in file_indices]
+            checksums: List[Crc32] = []
+
+            def iter_source():
+                checksums.clear()
+                for name in group_names:
+                    checksum = Crc32()
+                    checksums.append(checksum)
+                    with open(os.path.join(source_dir, name), mode='r', encoding='iso-8859-1', newline='') as f:
+                        yield from checksum.update_iter(iter_chars(f))
+
+            group_offset = dest_f.tell()
+            encode_stream(iter_source, sum(group_lengths), dest_f, coding_params)
+            groups.append(SolidGroup(group_offset, dest_f.tell() - group_offset))
+
+            offset = 0
+            for name, length, checksum in zip(group_names, group_lengths, checksums):
+                entries.append(ArchiveEntry(name, group_idx, offset, length, checksum.value))
+                offset += length
+
+        table_offset = dest_f.tell()
+        table = EntryTable(groups, entries)
+        dest_f.write(table.serialize())
+        dest_f.write(EntryTable.serialize_footer(table_offset))
+
+
+def list_entries(source_file) -> EntryTable:
+    with open(source_file, mode='rb') as f:
+        return EntryTable.read_from_archive(f)
+
+
+def extract(source_file, dest_dir, names: Optional[Iterable[str]] = None):
+    with open(source_file, mode='rb') as f:
+        table = EntryTable.read_from_archive(f)
+
+        wanted = set(names) if names is not None else {entry.name for entry in table.entries}
+        unknown = wanted - {entry.name for entry in table.entries}
+        if unknown:
+            raise Exception(f'No such entries: {", ".join(sorted(unknown))}')
+
+        for group_idx in sorted({entry.group for entry in table.entries if entry.name in wanted}):
+            group_entries = [entry for entry in table.entries if entry.group == group_idx]
+            _decode_group(f, table.groups[group_idx], group_entries, wanted, dest_dir)
+
+
+# decodes groups in parallel, they don't share anything
+def verify(source_file, jobs: Optional[int] = None):
+    with open(source_file, mode='rb') as f:
+        table = EntryTable.read_from_archive(f)
+
+    group_args = [(source_file, group, [entry for entry in table.entries if entry.group == group_idx])
+                  for group_idx, group in enumerate(table.groups)]
+    if jobs == 1 or len(group_args) <= 1:
+        for args in group_args:
+            _verify_group(*args)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for future in [executor.submit(_verify_group, *args) for args in group_args]:
+            future.result()
+
+
+def _verify_group(source_file, group: SolidGroup, group_entries: List[ArchiveEntry]):
+    with open(source_file, mode='rb') as f:
+        _decode_group(f, group, group_entries, set(), None)
+
+
+# Decodes the group only up to the last wanted entry; each entry is checked against its own crc32.
+# Decoding the whole group also checks the group trailer
+def _decode_group(f, group: SolidGroup, group_entries: List[ArchiveEntry], wanted, dest_dir):
+    f.seek(group.offset)
+    text = StrIterReader(decode_stream(RangeReader(f, group.length)))
+
+    group_entries = sorted(group_entries, key=lambda entry: entry.offset)
+    is_whole_group = dest_dir is None or all(entry.name in wanted for entry in group_entries)
+    if not is_whole_group:
+        last_wanted = max(i for i, entry in enumerate(group_entries) if entry.name in wanted)
+        group_entries = group_entries[:last_wanted + 1]
+
+    for entry in group_entries:
+        dest_f = None
+        if dest_dir is not None and entry.name in wanted:
+            dest_f = _open_entry_dest(dest_dir, entry.name)
+
+        checksum = Crc32()
+        left = entry.length
+        while left > 0:
+            chunk = text.read(min(left, EXTRACT_CHUNK_SIZE))
+            if len(chunk) == 0:
+                raise Exception(f'{entry.name}: unexpected end of group')
+            checksum.update(chunk)
+            if dest_f is not None:
+                dest_f.write(chunk)
+            left -= len(chunk)
+
+        if dest_f is not None:
+            dest_f.close()
+        if checksum.value != entry.crc32:
+            raise ChecksumError(f'{entry.name}: checksum mismatch')
+
+    if is_whole_group:
+        text.read(1)  # lets decode_stream check the trailer
+
+
+def _open_entry_dest(dest_dir, name):
+    parts = name.split('/')
+    if os.path.isabs(name) or '..' in parts:
+        raise Exception(f'Unsafe entry name: {name}')
+    path = os.path.join(dest_dir, *parts)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return open(path, mode='w', encoding='iso-8859-1', newline='')
@@ -1,3 +1,52 @@
+import io
+import asyncio
+import itertools
+import json
+import math
+import os
+import sys
+import time
+import shutil
+import socket
+import subprocess
+import contextlib
+import dataclasses
+from main import zip, unzip, estimate, verify, batch, read_batch_tasks
+from coding.coding_params import CodingParams, UpCharCodingAlrorithm
+from coding.segments import SEGMENT_LENGTH
+from coding.stats import CodingStats
+from coding.stream import StreamHeaders
+from coding.messages import MessageEncoder, iter_messages
+from headers.checksum_trailer import ChecksumTrailer, ChecksumError
+from headers.header import Header, HeaderError
+from headers.segment_header import SegmentHeader
+from headers.daemon_protocol import DaemonOp, DaemonResponse
+import async_api
+import daemon_client
+import solid_archive
+
+TEST_SOCKET = '/tmp/ppm-coder-test.sock'
+
+# every CodingParams option on its own, on top of the defaults
+FLAG_CHANGES = [
+    {},
+    dict(mask_seen=False),
+    dict(exclude_on_update=True),
+    dict(decapitalize=True),
+    dict(inherit_counts=True),
+    dict(up_char_coding=UpCharCodingAlrorithm.E_SEE),
+    dict(match_length=12),
+    dict(word_dictionary=True),
+    dict(unbounded_order=True),
+    dict(stored_segments=True),
+    dict(segmented=True),
+    dict(semi_static=True),
+    dict(line_contexts=True),
+    dict(hash_bits=12),
+    dict(mixing=True),
+]
+
+
 def test(f_name, coding_params=None):
     f_name = f'tests/{f_name}'
 
@@ -33,6 +82,269 @@ def test(f_name, coding_params=None):
         print(f'Passed {ctx_len}, {mask}, {exclude}, {up_coding} for {f_name}')
     print(f'PASSED ALL FOR {f_name}')
 
+# round trip, and estimate gives the size zip writes (the estimator rounds the coder's flush, up to a byte per segment)
+def test_flags(f_name):
+    for changes in FLAG_CHANGES:
+        coding_params = dataclasses.replace(CodingParams(), **changes)
+        zip(f_name, f'{f_name}.zip', coding_params)
+        unzip(f'{f_name}.zip', f'{f_name}.unzipped')
+
+        with open(f_name, mode='rb') as original_f:
+            with open(f'{f_name}.unzipped', mode='rb') as unzipped_f:
+                if original_f.read() != unzipped_f.read():
+                    print(f'Files binaries differ for {changes}')
+                    raise AssertionError()
+
+        actual = os.path.getsize(f'{f_name}.zip')
+        estimated = estimate(f_name, coding_params)
+        if abs(estimated - actual) > 1 + os.path.getsize(f_name) // SEGMENT_LENGTH:
+            print(f'Estimated {estimated} bytes, zip wrote {actual} for {changes}')
+            raise AssertionError()
+
+        print(f'Passed {changes} for {f_name}: {actual} bytes, estimated {estimated}')
+    print(f'PASSED ALL FLAGS FOR {f_name}')
+
+
+# every char is counted, and the coder's output bits are the archive without its headers and trailer
+def test_stats(f_name):
+    stats = CodingStats()
+    zip(f_name, f'{f_name}.zip', stats=stats)
+    with open(f'{f_name}.zip', mode='rb') as archive_f:
+        StreamHeaders.read(archive_f)
+        body_length = os.path.getsize(f'{f_name}.zip') - archive_f.tell() - ChecksumTrailer.trailer_length()
+    if stats.symbols != os.path.getsize(f_name) or math.ceil(stats.output_bits / 8) != body_length:
+        print(f'Counted {stats.symbols} chars, {stats.output_bits} bits for {body_length} coded bytes')
+        raise AssertionError()
+    print(f'PASSED STATS FOR {f_name}')
+
+
+# a directory with a subdirectory and an empty file, packed into two groups: listed, extracted in full and one
+# entry alone, verified
+def test_solid(f_name):
+    with open(f_name, mode='rb') as text_f:
+        text = text_f.read()
+    files = {'text.txt': text, 'sub/half.log': text[:len(text) // 2], 'empty.txt': b''}
+    source_dir, dest_dir = f'{f_name}.dir', f'{f_name}.extracted'
+    for path in [source_dir, dest_dir]:
+        shutil.rmtree(path, ignore_errors=True)
+    for name, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(source_dir, name)), exist_ok=True)
+        with open(os.path.join(source_dir, name), mode='wb') as f:
+            f.write(content)
+
+    solid_archive.pack(source_dir, f'{f_name}.solid', solid_size=len(text) // 2)
+    table = solid_archive.list_entries(f'{f_name}.solid')
+    if {entry.name: entry.length for entry in table.entries} != {name: len(c) for name, c in files.items()} \
+            or len(table.groups) != 2:
+        print(f'Listed {table.entries} in {len(table.groups)} groups')
+        raise AssertionError()
+
+    verify(f'{f_name}.solid')
+    solid_archive.extract(f'{f_name}.solid', dest_dir)
+    for name, content in files.items():
+        with open(os.path.join(dest_dir, name), mode='rb') as f:
+            if f.read() != content:
+                print(f'Extracted {name} differs')
+                raise AssertionError()
+    shutil.rmtree(dest_dir)
+    solid_archive.extract(f'{f_name}.solid', dest_dir, ['sub/half.log'])
+    if os.listdir(dest_dir) != ['sub'] or os.listdir(os.path.join(dest_dir, 'sub')) != ['half.log']:
+        print(f'Extracted {os.listdir(dest_dir)} for one entry')
+        raise AssertionError()
+    print(f'PASSED SOLID FOR {f_name}')
+
+
+# a manifest with a good line, a line that isn't a task and a missing file: the good one is zipped, the other two
+# are reported; the glob batch unzips it back
+def test_batch(f_name):
+    batch_dir = f'{f_name}.batch'
+    shutil.rmtree(batch_dir, ignore_errors=True)
+    os.makedirs(batch_dir)
+    with open(f'{f_name}.manifest', mode='w', encoding='utf-8') as manifest_f:
+        manifest_f.write(f'{f_name}\t{batch_dir}/good.zip\n'
+                         f'{f_name} {batch_dir}/no_tab.zip\n'
+                         f'{f_name}.missing\t{batch_dir}/missing.zip\n')
+
+    result = batch(read_batch_tasks(f'{f_name}.manifest', None, 'zip'), 'zip', jobs=2)
+    failed = sorted(task.source_file for task, _ in result.failed)
+    if result.ok != 1 or failed != [f'{f_name} {batch_dir}/no_tab.zip', f'{f_name}.missing'] \
+            or os.listdir(batch_dir) != ['good.zip']:
+        print(f'Batch zipped {result.ok}, failed {result.failed}, wrote {os.listdir(batch_dir)}')
+        raise AssertionError()
+
+    result = batch(read_batch_tasks(f'{batch_dir}/*.zip', batch_dir, 'unzip'), 'unzip', jobs=2)
+    with open(f_name, mode='rb') as original_f:
+        with open(f'{batch_dir}/good', mode='rb') as unzipped_f:
+            if result.ok != 1 or result.failed or original_f.read() != unzipped_f.read():
+                print(f'Batch unzipped {result.ok}, failed {result.failed}')
+                raise AssertionError()
+    print(f'PASSED BATCH FOR {f_name}')
+
+
+# a StreamWriter stand-in, async_api only needs write and drain
+class _BytesWriter:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+# two streams at once, fed in odd-sized chunks: the archive is the one zip writes, and it decompresses back
+def test_async(f_name):
+    with open(f_name, mode='rb') as text_f:
+        text = text_f.read()
+    zip(f_name, f'{f_name}.zip')
+    with open(f'{f_name}.zip', mode='rb') as archive_f:
+        archive = archive_f.read()
+
+    async def chunks(data, size=1000):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    async def round_trip():
+        compressed = _BytesWriter()
+        await async_api.compress(chunks(text), compressed, len(text))
+        decompressed = _BytesWriter()
+        await async_api.decompress(chunks(bytes(compressed.data), 333), decompressed)
+        return bytes(compressed.data), bytes(decompressed.data)
+
+    async def both():
+        return await asyncio.gather(round_trip(), round_trip())
+
+    for compressed, decompressed in asyncio.run(both()):
+        if compressed != archive or decompressed != text:
+            print(f'Async stream wrote {len(compressed)} bytes, zip {len(archive)}')
+            raise AssertionError()
+    print(f'PASSED ASYNC FOR {f_name}')
+
+
+# every line is a message, sent over a socket and read back before the next one is sent; a flipped byte in the
+# last message fails its checksum, the ones before it still come out
+def test_messages(f_name):
+    with open(f_name, mode='rb') as text_f:
+        messages = text_f.read().splitlines(keepends=True)[:500] + [b'', bytes(range(256)) * 4]
+
+    sender, receiver = socket.socketpair()
+    with sender, receiver, sender.makefile('wb') as dest_f, receiver.makefile('rb') as input_f:
+        received = iter_messages(input_f)
+        with MessageEncoder(dest_f, CodingParams(stored_segments=True)) as encoder:
+            for message in messages:
+                encoder.send(message)
+                if next(received) != message:
+                    raise AssertionError('Message differs')
+        if next(received, None) is not None:
+            raise AssertionError('Message after the end of the stream')
+
+    stream = io.BytesIO()
+    with MessageEncoder(stream) as encoder:
+        for message in messages[:-2]:
+            last_start = stream.tell()
+            encoder.send(message)
+    corrupted = bytearray(stream.getvalue())
+    corrupted[last_start + SegmentHeader.header_length()] ^= 0x10
+    received = iter_messages(io.BytesIO(corrupted))
+    if [next(received) for _ in messages[:-3]] != messages[:-3]:
+        raise AssertionError('Message before the corrupted one differs')
+    try:
+        next(received)
+        raise AssertionError('A corrupted message passed')
+    except ChecksumError:
+        pass
+    print(f'PASSED MESSAGES FOR {f_name}')
+
+
+# daemon.py in its own process (it handles SIGTERM/SIGINT, which only works in the main thread)
+@contextlib.contextmanager
+def running_daemon(socket_path=TEST_SOCKET):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py'),
+                                'daemon', socket_path, '-j', '1'], stderr=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(socket_path):
+            if process.poll() is not None:
+                raise Exception(f'Daemon exited with code {process.returncode}')
+            time.sleep(0.1)
+        yield socket_path
+    finally:
+        process.terminate()
+        process.wait()
+
+
+# the daemon writes the archive zip writes, with the requested options, unzips it back and counts both requests
+def test_daemon(f_name):
+    coding_params = CodingParams(exclude_on_update=True)
+    with open(f_name, mode='rb') as text_f:
+        text = text_f.read()
+    zip(f_name, f'{f_name}.zip', coding_params)
+    with open(f'{f_name}.zip', mode='rb') as archive_f:
+        archive = archive_f.read()
+
+    with running_daemon() as socket_path:
+        if daemon_client.request(DaemonOp.ZIP, text, coding_params, socket_path) != archive:
+            raise AssertionError('Daemon archive differs from zip')
+        if daemon_client.request(DaemonOp.UNZIP, archive, socket_path=socket_path) != text:
+            raise AssertionError('Daemon unzipped a different text')
+        status = json.loads(daemon_client.request(DaemonOp.STATUS, socket_path=socket_path))
+        if status['served'] != 2 or status['failed'] != 0:
+            print(f'Daemon status {status}')
+            raise AssertionError()
+    print(f'PASSED DAEMON FOR {f_name}')
+
+
+# a text that isn't an archive and an archive with a flipped byte fail with an error, the daemon answers both
+def test_bad_input(f_name):
+    zip(f_name, f'{f_name}.zip')
+    with open(f'{f_name}.zip', mode='rb') as archive_f:
+        corrupted = bytearray(archive_f.read())
+    corrupted[len(corrupted) // 2] ^= 0x10
+    with open(f'{f_name}.corrupted', mode='wb') as corrupted_f:
+        corrupted_f.write(corrupted)
+
+    try:
+        verify(f_name)
+        raise AssertionError('A text passed as an archive')
+    except HeaderError:
+        pass
+    try:
+        verify(f'{f_name}.corrupted')
+        raise AssertionError('A corrupted archive passed')
+    except AssertionError:
+        raise
+    except Exception:
+        pass
+
+    with open(f_name, mode='rb') as text_f:
+        text = text_f.read()
+    with running_daemon() as socket_path:
+        for payload in [text, bytes(corrupted)]:
+            try:
+                daemon_client.request(DaemonOp.UNZIP, payload, socket_path=socket_path)
+                raise AssertionError('Daemon unzipped a bad archive')
+            except AssertionError:
+                raise
+            except Exception as e:
+                print(f'Daemon refused a bad archive: {e}')
+        # a request whose own header isn't one: answered, not dropped
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+            s.sendall(bytes([DaemonOp.UNZIP.value]) + text[:Header.header_length()])
+            response = DaemonResponse.deserialize(daemon_client._recv_exactly(s, DaemonResponse.response_length()))
+            message = daemon_client._recv_exactly(s, response.length).decode('utf-8')
+            if response.ok or not message.startswith('Bad request'):
+                print(f'Daemon answered a bad request header with {response.ok} {message}')
+                raise AssertionError()
+        # and it still serves
+        archive = daemon_client.request(DaemonOp.ZIP, text, socket_path=socket_path)
+        if daemon_client.request(DaemonOp.UNZIP, archive, socket_path=socket_path) != text:
+            raise AssertionError('Daemon round trip after bad requests')
+    print(f'PASSED BAD INPUT FOR {f_name}')
+
+
 def run_tests():
     pass
     # test('empty.txt')
@@ -53,4 +365,17 @@ def run_tests():
     # loop(5)
     # test('Martin, George RR - Ice and Fire 4 - A Feast for Crows.txt',
     #      (6, True, True, UpCharCodingAlrorithm.D_PLUS_HALF_ON_NEW_CHAR, False))
-    # test('Mini-Martin.txt', (6, True, False, UpCharCodingAlrorithm.D_PLUS_HALF_ON_NEW_CHAR, True))
\ No newline at end of file
+    # test('Mini-Martin.txt', (6, True, False, UpCharCodingAlrorithm.D_PLUS_HALF_ON_NEW_CHAR, True))
+    # test_flags('tests/test.txt')
+
+
+if __name__ == '__main__':
+    for f_name in sys.argv[1:]:
+        test_flags(f_name)
+        test_stats(f_name)
+        test_solid(f_name)
+        test_batch(f_name)
+        test_async(f_name)
+        test_daemon(f_name)
+        test_messages(f_name)
+        test_bad_input(f_name)
@@ -0,0 +1,21 @@
+import zlib
+from typing import Iterable
+
+
+class Crc32:
+    def __init__(self):
+        self.value = 0
+
+    # passes strings through, value is final only after the iterator is exhausted
+    def update_iter(self, iter_strs: Iterable[str], chunk_size=5 * 1024) -> Iterable[str]:
+        chunk = []
+        for s in iter_strs:
+            chunk.append(s)
+            if len(chunk) == chunk_size:
+                self.update(''.join(chunk))
+                chunk.clear()
+            yield s
+        self.update(''.join(chunk))
+
+    def update(self, s: str):
+        self.value = zlib.crc32(s.encode('iso-8859-1'), self.value)
@@ -0,0 +1,35 @@
+from coding.coding_params import CodingParams, UpCharCodingAlrorithm
+
+
+# shared by main.py and the thin daemon_client.py, which shouldn't import the coder itself
+def add_coding_params_args(parser):
+    parser.add_argument('-K', '--ctx_length', type=int, default=5)
+    parser.add_argument('-m', '--mask', type=bool, default=True)
+    parser.add_argument('-e', '--exclude', type=bool, default=False)
+    parser.add_argument('-u', '--up_algo', type=str, choices=['A', 'B', 'C', 'D', 'E'], default='D')
+    parser.add_argument('-c', '--decapitalize', type=bool, default=False)
+    parser.add_argument('-i', '--inherit', action='store_true')
+    parser.add_argument('--match_length', type=int, default=0,
+                        help='min repeat length for the long-range match model, 0 to turn it off; '
+                             '12 is the best on both logs and source/text samples')
+    parser.add_argument('--unbounded', action='store_true',
+                        help='PPM*: deterministic contexts of any length on top of the -K ones')
+    parser.add_argument('-w', '--words', action='store_true',
+                        help='replace frequent words with one-char codes before modelling')
+    parser.add_argument('--stored', action='store_true',
+                        help='write incompressible segments as is instead of coding them')
+    parser.add_argument('--semi_static', action='store_true',
+                        help='code against a frozen model from a first pass, so that segments decode in parallel')
+    parser.add_argument('--lines', action='store_true',
+                        help='predict chars from the same field of the previous line (logs, CSV)')
+    parser.add_argument('--hash_bits', type=int, default=0,
+                        help='contexts in hashed tables of 2^N entries per order instead of a tree, 0 for the tree')
+    parser.add_argument('--mix', action='store_true',
+                        help='mix PPM with order-1/order-2 bit models: smaller archives, several times slower')
+
+
+def coding_params_from_args(args) -> CodingParams:
+    return CodingParams(args.ctx_length, args.mask, args.exclude, UpCharCodingAlrorithm.from_letter(args.up_algo),
+                        args.decapitalize, args.inherit, args.match_length, args.words, args.unbounded,
+                        args.stored, args.semi_static, args.lines, args.hash_bits,
+                        args.mix)
@@ -64,3 +64,52 @@ class ExtendableFenwickTree:
 
     def __repr__(self):
         return f'{self.inner.frequencies()[:self.length]} => {[self.inner.prefix_sum(i) for i in range(1, self.length + 1)]}'
+
+
+# Read-only view of distribution.without_chars(chars_to_exclude, ...) that is enough for -log2(p):
+# indices stay the distribution's own, and only whole-distribution prefix sums are known.
+# add() is for the escape frequency (SEE), it changes the view, not the distribution
+class MaskedFrequencies:
+    def __init__(self, distribution: ExtendableFenwickTree, chars_to_exclude, chars_to_indices):
+        self.distribution = distribution
+        excluded = [chars_to_indices[c] for c in chars_to_exclude if c in chars_to_indices]
+        self.length = len(distribution) - len(excluded)
+        self.total = distribution.prefix_sum(len(distribution)) - sum(distribution[i] for i in excluded)
+        self.deltas = {}
+
+    def prefix_sum(self, stop):
+        if stop != self.length:
+            raise Exception('MaskedFrequencies only knows the total')
+        return self.total
+
+    def add(self, idx, k):
+        self.deltas[idx] = self.deltas.get(idx, 0) + k
+        self.total += k
+
+    def __getitem__(self, idx):
+        return self.distribution[idx] + self.deltas.get(idx, 0)
+
+    def __len__(self):
+        return self.length
+
+
+# Plain list of frequencies with the same read interface as the Fenwick trees, for distributions that are
+# built for one step and thrown away (see HashedContextTable): building a tree would cost more than the sums
+class PlainFrequencies:
+    def __init__(self, freqs):
+        self.freqs = freqs
+        self.sums = [0] * (len(freqs) + 1)
+        for i, freq in enumerate(freqs):
+            self.sums[i + 1] = self.sums[i] + freq
+
+    def prefix_sum(self, stop):
+        return self.sums[stop]
+
+    def __getitem__(self, idx):
+        return self.freqs[idx]
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def __repr__(self):
+        return f'{self.freqs} => {self.sums[1:]}'
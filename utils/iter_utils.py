@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Iterable, Callable, Optional
 from bitarray import bitarray
 
 def bits_to_bytes(iter_bits: Iterable[int]) -> bytes:
@@ -29,6 +29,17 @@ def iter_chars(f, chunk_size=5 * 1024):
         yield from chars
 
 
+LATIN1_CHARS = [chr(i) for i in range(256)]
+
+
+# chars of a bytes-like object (e.g. an mmapped file) with no decoding layer and no chunk copies,
+# byte i is chr(i) in iso-8859-1
+def iter_buffer_chars(buf):
+    with memoryview(buf) as view:
+        for b in view:
+            yield LATIN1_CHARS[b]
+
+
 def write_bits(iter_bits, f, chunk_size=5 * 1024):
     bits = bitarray(0, endian='big')
     for bit in iter_bits:
@@ -50,3 +61,129 @@ def write_chars(iter_chars, f, chunk_size=5 * 1024):
             f.write(''.join(chars))
 
     f.write(''.join(chars[: (i + 1) % chunk_size]))
+
+
+# into a preallocated writable buffer (e.g. an mmapped file of known length), returns the written length
+def write_chars_to_buffer(iter_chars, buf, chunk_size=64 * 1024):
+    pos = 0
+    chars = []
+    for char in iter_chars:
+        chars.append(char)
+        if len(chars) == chunk_size:
+            pos = _put_chars(chars, buf, pos)
+    return _put_chars(chars, buf, pos)
+
+
+def _put_chars(chars, buf, pos):
+    chunk = ''.join(chars).encode('iso-8859-1')
+    chars.clear()
+    if pos + len(chunk) > len(buf):
+        raise Exception(f'Decoded text is longer than {len(buf)} chars')
+    buf[pos:pos + len(chunk)] = chunk
+    return pos + len(chunk)
+
+
+# file-like wrapper that never returns the last tail_length bytes of f (e.g. a trailer after the coded bits),
+# works on pipes too since it doesn't need to know the length in advance
+class TailHoldingReader:
+    def __init__(self, f, tail_length, chunk_size=64 * 1024):
+        self.f = f
+        self.tail_length = tail_length
+        self.chunk_size = chunk_size
+        self.buf = bytearray()
+        self.eof = False
+
+    def read(self, n=-1):
+        while not self.eof and (n < 0 or len(self.buf) < n + self.tail_length):
+            chunk = self.f.read(self.chunk_size if n < 0 else max(n, self.chunk_size))
+            if not chunk:
+                self.eof = True
+            self.buf += chunk
+
+        available = max(len(self.buf) - self.tail_length, 0)
+        n = available if n < 0 else min(n, available)
+        res = bytes(self.buf[:n])
+        del self.buf[:n]
+        return res
+
+    def tail(self) -> bytes:
+        self.read()
+        return bytes(self.buf)
+
+
+# file-like view of the next length bytes of f
+class RangeReader:
+    def __init__(self, f, length):
+        self.f = f
+        self.left = length
+
+    def read(self, n=-1):
+        n = self.left if n < 0 else min(n, self.left)
+        res = self.f.read(n)
+        self.left -= len(res)
+        return res
+
+
+# file-like reader over an iterator of strings of any length (e.g. capitalize_iter output)
+class StrIterReader:
+    def __init__(self, iter_strs):
+        self.iter_strs = iter(iter_strs)
+        self.buf = ''
+
+    def read(self, n):
+        pieces = [self.buf]
+        have = len(self.buf)
+        while have < n:
+            s = next(self.iter_strs, None)
+            if s is None:
+                break
+            pieces.append(s)
+            have += len(s)
+        joined = ''.join(pieces)
+        self.buf = joined[n:]
+        return joined[:n]
+
+
+# strings of any length -> strings of about chunk_size chars
+def iter_str_chunks(iter_strs: Iterable[str], chunk_size=64 * 1024) -> Iterable[str]:
+    chunk = []
+    chunk_length = 0
+    for s in iter_strs:
+        chunk.append(s)
+        chunk_length += len(s)
+        if chunk_length >= chunk_size:
+            yield ''.join(chunk)
+            chunk.clear()
+            chunk_length = 0
+    if chunk_length > 0:
+        yield ''.join(chunk)
+
+
+# file-like writer that hands every write to put (e.g. a bounded queue, so a slow consumer stalls the writer)
+class QueueWriter:
+    def __init__(self, put: Callable[[bytes], None]):
+        self.put = put
+
+    def write(self, b):
+        self.put(bytes(b))
+
+
+# file-like reader over chunks from get, None from get is the end
+class QueueReader:
+    def __init__(self, get: Callable[[], Optional[bytes]]):
+        self.get = get
+        self.buf = bytearray()
+        self.eof = False
+
+    def read(self, n=-1):
+        while not self.eof and (n < 0 or len(self.buf) < n):
+            chunk = self.get()
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buf += chunk
+
+        n = len(self.buf) if n < 0 else min(n, len(self.buf))
+        res = bytes(self.buf[:n])
+        del self.buf[:n]
+        return res